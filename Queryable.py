@@ -16,7 +16,7 @@ possible number of manipulations to get your data into and out
 of the JSON array.
 
 USAGE:
-from Queryable import db_object
+from Queryable import db_object, db_archive, database
 
 # load from file
 db = db_object().setPath('/optional/path/to_save/or_load/from.json').load()
@@ -31,34 +31,322 @@ db = db_object().data(json-array_or_json-string)
 res = db.find({'key':'value'})
         # returns a db_result
         # db_result contains the rows that match find() params
-        # the methods to sort().limit().skip() -- methods can be chained
+        # the methods to sort().limit().skip() -- methods can be chained,
+        # and nothing runs until the rows are read
 # can use regex values
 res = db.find({'key':re.compile('^[0-9]+value')})
-
+res = db.find({'key':{'$regex':'^ORD-2026', '$options':'i'}})
+# read-only consumers can skip copying rows out of the db
+res = db.find({'key':'value'}, copy=False)
+# only some fields: {'name':1,'ts':1} or all but some: {'blob':0}
+res = db.find({'key':'value'}, {'name':1,'ts':1})
+# many queries, one pass over the rows: a db_result per query
+a, b = db.find_many([{'key':'value'}, {'ts':{'$gt':5}}], limits=[None, 10])
+
+# these stop at the first match, or just count, without building a result
+db.exists({'key':'value'}); db.count({'key':'value'}); db.find_one({'key':'value'})
+
+db.insert(row_or_rows)
+# bulk load: one block of _ids, one 'now()' timestamp, indexes updated once
+db.insert_many(rows, validate=False, stamp=False)
 db.update()
-db.remove()
+db.remove()    # returns the number of rows removed
 db.save()
 
+# export without building the whole string: to a file or HTTP response,
+# or piece by piece
+db.find({'key':'value'}).write_to(fileobj, compact=True)
+for piece in db.iter_json(chunk_rows=1000): ...
+
+# one row per line, streamed: pick by .jsonl extension or fmt='jsonl'
+db = db_object(path='/path/to/from.jsonl').load()
+# binary snapshot for fast restarts: .snap extension or fmt='snap'
+db = db_object(path='/path/to/from.snap').load()
+# orjson is used for JSON when installed; db.codec = db_codec(fast=False) opts out
+
+# read-only archive: mmap'd jsonl, rows decoded only as queries reach them
+db = db_archive(path='/path/to/archive.jsonl').load()
+
+# live view of a standing query, kept current by insert/update/remove
+view = db.view({'status':'open'}, sort={'ts':-1}, callback=lambda event, row: ...)
+view.data
+
+# thread-safe: reads run together, writes one at a time. A snapshot gives
+# long reads a consistent view without holding up writers
+snap = db.snapshot()
+
+# a directory of collections, each loaded on first use; save() writes the changed ones
+dbs = database('/path/to/dir', memory_budget=256 << 20)
+dbs['users'].insert({'name':'x'})
+dbs.save()
+
+# asyncio: load/save/find off the event loop, results streamed back
+adb = async_db_object(db)
+async for row in adb.afind({'key':'value'}): ...
+
+# roll-ups, streamed through $match, $group, $sort, $limit and $project
+db.aggregate([{'$match':{'kind':'a'}}, {'$group':{'_id':'$user','n':{'$sum':1}}}])
+
+# how a query runs, stage by stage; and a hook for the slow ones
+db.explain({'key':'value'})
+db.on_slow_query(lambda info: print(info), ms=50)
+
+# journaled: save() appends just the changes to from.json.journal
+db = db_object(path='/path/to/from.json', journal=True).load()
+db.compact()   # fold the journal back into from.json
+
+# hash index a field; find/remove/update use it for equality and $in
+db.create_index('key')
+# ordered index also serves $lt/$lte/$gt/$gte, db_result.sort() and regexes
+# starting with literal text, like '^ORD-2026' 
+db.create_index('ts', ordered=True)
+
 TODO:
 - make correct methods @staticmethod and @classmethod
 - move comparators to class level
 """
 
 import json
+import io
+import math
+import os
 import re
-from operator import attrgetter
+from operator import attrgetter, itemgetter
 import copy
+import bisect
+import time
+import asyncio
+import threading
+import contextlib
+import weakref
+import multiprocessing
+import concurrent.futures
+import mmap
+from array import array
+import heapq
+import itertools
+import functools
+import marshal
+from collections import OrderedDict
 from datetime import datetime
+try:
+    import orjson
+except ImportError: # optional, json is used without it
+    orjson = None
+
+def json_chunks(rows, chunk_rows=1000, compact=True, guard=contextlib.nullcontext):
+    """
+    Yield rows as one JSON array, in pieces of up to chunk_rows rows each,
+    encoding a row only when its piece is reached. The pieces join up to
+    exactly what json.dumps(rows) gives, compact or with indent=2
+
+    guard: context manager factory held while each piece is encoded, such
+           as a db's read lock, but not while the piece is handed out
+    """
+    if compact:
+        xa, start, sep, end = {'separators':(',',':')}, '[', ',', ']'
+    else:
+        xa, start, sep, end = {'indent':2}, '[\n  ', ',\n  ', '\n]'
+    def encode(row):
+        text = json.dumps(row, **xa)
+        if not compact:
+            text = text.replace('\n', '\n  ') # newlines in strings are escaped
+        return text
+    rows = iter(rows)
+    out = None  # held back a piece, so the last one carries the closing bracket
+    while True:
+        with guard():
+            piece = [encode(row) for row in itertools.islice(rows, chunk_rows)]
+        if not piece:
+            break
+        if out is not None:
+            yield out
+        out = (start if out is None else sep) + sep.join(piece)
+    yield '[]' if out is None else out + end
+
+
+def write_chunks(chunks, fileobj):
+    """
+    Write the pieces from json_chunks to fileobj, encoded as UTF-8 if it is binary
+    """
+    binary = isinstance(fileobj, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(fileobj, 'mode', '')
+    for chunk in chunks:
+        fileobj.write(chunk.encode('utf-8') if binary else chunk)
+
 
 class db_result:
-    def __init__(self, init_data):
-        if type(init_data) is type([]):
-            self.data = copy.deepcopy(init_data)
+    def __init__(self, init_data, db=None, copy=True, query=None, projection=None):
+        """
+        A lazy cursor. sort/skip/limit are only recorded, and run as one plan
+        the first time the rows are needed: no sorting past a limit (top-k on
+        a heap), nothing kept before a skip. Rows are held by reference, and
+        only the rows that come out are deep copied, when .data is first read.
+
+        db:    the db_object init_data rows belong to, letting the plan use
+               its indexes
+        copy:  False hands out the db's own rows from .data, for read-only use
+        query: compiled db_query the rows must match
+        projection: (key, function) from db_object.projector, cutting each row
+               down to the wanted fields before anything is copied
+        """
+        self._db = db
+        self._copy = copy
+        self._query = query
+        self._projection = projection
+        self._scanned = 0       # rows the last plan started from
+        self._sort = None       # [(key, direction)]
+        self._skip = 0
+        self._limit = None
+        self._data = None
+        if type(init_data) is type([]) or isinstance(init_data, db_rows):
+            self._rows = init_data
         elif type(init_data) is type({}):
-            self.data = [ copy.deepcopy(init_data) ]
+            self._rows = [ init_data ]
         else:
             raise Exception('db_result: bad input')
 
+    @property
+    def data(self):
+        if self._data is None:
+            with self.reading():
+                rows = self.rows()
+                # copied under the read lock: writers change rows in place
+                self._data = copy.deepcopy(rows) if self._copy else rows
+            self._rows = None
+        return self._data
+
+    def reading(self):
+        """
+        The read lock of our db, if any
+        """
+        if self._db is None:
+            return contextlib.nullcontext()
+        return self._db._lock.reading()
+
+    @data.setter
+    def data(self, rows):
+        self._data = rows
+        self._rows = None
+        self._query = None
+        self._projection = None
+        self._sort = None
+        self._skip = 0
+        self._limit = None
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def pending(self):
+        return self._query is not None or self._sort is not None or \
+                self._skip != 0 or self._limit is not None or self._projection is not None
+
+    def rows(self):
+        """
+        Run the plan and return the resulting rows, without copying them
+        """
+        if self._data is not None:
+            return self._data
+        if self.pending() or type(self._rows) is not type([]) or \
+                (self._db is not None and self._rows is self._db._data):
+            self._rows = self.run()
+            self._query = None
+            self._projection = None
+            self._sort = None
+            self._skip = 0
+            self._limit = None
+        return self._rows
+
+    def run(self):
+        db = self._db
+        if db is None:
+            return self.execute()
+        if db._slow is not None:
+            start = time.perf_counter()
+            res = self.cached_run()
+            query = self._query.clauses if self._query is not None else {}
+            db.timed('find', query, start, self._scanned, len(res))
+            return res
+        return self.cached_run()
+
+    def cached_run(self):
+        db = self._db
+        with db._lock.reading():
+            if db._results is not None and self._rows is db._data:
+                qkey = self._query.key if self._query is not None else ()
+                if qkey is not None:
+                    pkey = self._projection[0] if self._projection is not None else ()
+                    key = ('find', qkey, pkey, tuple(self._sort or ()), self._skip, self._limit)
+                    rows = db.cached(key, self.execute)
+                    if self._projection is not None and not self._copy:
+                        # projected rows are the cache's own, not the db's: each
+                        # caller gets its own, as an uncached run would give
+                        return [dict(row) for row in rows]
+                    return list(rows)
+            return self.execute()
+
+    def execute(self):
+        rows = self._rows
+        self._scanned = len(rows)
+        test = self._query.test if self._query is not None else None
+        presorted = False
+        db = self._db
+        if db is not None and db._indexes and rows is db._data:
+            scanned = db.index_scan(self._query) if test is not None else None
+            if scanned is not None:
+                rows, test = scanned
+                self._scanned = len(rows)
+            elif self._sort is not None and len(self._sort) == 1:
+                walk = db.index_order(self._sort[0][0], self._sort[0][1] < 0)
+                if walk is not None:
+                    rows, presorted = walk, True
+        if test is not None:
+            scanned = None
+            if db is not None and rows is db._data and test is self._query.test:
+                scanned = db.parallel_scan(self._query)
+            rows = scanned if scanned is not None else filter(test, rows)
+        stop = None if self._limit is None else self._skip + self._limit
+        if self._sort is not None and not presorted:
+            key, reverse = db_result.sort_key(self._sort)
+            if stop is None:
+                rows = sorted(rows, key=key, reverse=reverse)
+            elif reverse:
+                rows = heapq.nlargest(stop, rows, key=key)
+            else:
+                rows = heapq.nsmallest(stop, rows, key=key)
+        rows = itertools.islice(rows, self._skip, stop)
+        if self._projection is not None:
+            return list(map(self._projection[1], rows))
+        return list(rows)
+
+    @staticmethod
+    def sort_key(spec):
+        """
+        (key function, reverse) sorting rows the way spec [(key, direction)] asks
+        """
+        if len(spec) == 1:
+            k = spec[0][0]
+            return (lambda B:B[k]), spec[0][1] < 0
+        keys = [k for k, d in spec]
+        if all(d < 0 for k, d in spec) or all(d >= 0 for k, d in spec):
+            return (lambda B:tuple(B[k] for k in keys)), spec[0][1] < 0
+        def cmp(A, B):
+            for k, d in spec:
+                if A[k] < B[k]:
+                    return 1 if d < 0 else -1
+                if B[k] < A[k]:
+                    return -1 if d < 0 else 1
+            return 0
+        return functools.cmp_to_key(cmp), False
+
+    def copy(self):
+        """
+        A db_result holding private deep copies of our rows
+        """
+        res = db_result([])
+        with self.reading():
+            res.data = copy.deepcopy(self.rows())
+        return res
+
     def push(self, obj):
         if type(obj) is type({}):
             self.data.append(obj)
@@ -69,38 +357,862 @@ class db_result:
         return self
 
     def sort(self, obj):
-        k = list(obj.keys())[0]
-        v = {'reverse':True} if obj[k] < 0 else {'reverse':False}
-        self.data = list(sorted(self.data, key=lambda B:B[k], **v))
+        """
+        obj: {key:direction, ...}, direction < 0 for descending. Later keys
+             break ties in earlier ones
+        """
+        spec = [(k, d) for k, d in obj.items()]
+        if self._data is not None:
+            key, reverse = db_result.sort_key(spec)
+            self._data = list(sorted(self._data, key=key, reverse=reverse))
+            return self
+        if self._skip != 0 or self._limit is not None:
+            self.rows() # sort applies to the window cut so far
+        if self._sort is not None:
+            # a stable re-sort only falls back on the previous order for ties
+            spec.extend(kd for kd in self._sort if kd[0] not in obj)
+        self._sort = spec
         return self
 
     def limit(self, ival):
-        self.data = self.data[:ival]
+        if ival is None:
+            return self # no limit
+        if self._data is not None:
+            self._data = self._data[:ival]
+        elif ival < 0:
+            self._rows = self.rows()[:ival]
+        else:
+            self._limit = ival if self._limit is None else min(self._limit, ival)
         return self
 
     def skip(self, ival):
-        self.data = self.data[ival:]
+        if ival is None:
+            return self # nothing skipped
+        if self._data is not None:
+            self._data = self._data[ival:]
+        elif ival < 0:
+            self._rows = self.rows()[ival:]
+        else:
+            self._skip += ival
+            if self._limit is not None:
+                self._limit = max(self._limit - ival, 0)
         return self
 
     def count(self):
-        return len(self.data)
+        return len(self.rows())
 
     def toString(self,compact=False):
-        xa = {'separators':(',',':')} if compact else {'indent':2}
-        return json.dumps(self.data, **xa)
+        return ''.join(self.iter_json(len(self.rows()) or 1, compact))
+
+    def iter_json(self, chunk_rows=1000, compact=False):
+        """
+        The rows as a JSON array, in pieces of chunk_rows rows, see json_chunks().
+        Each piece is encoded under the db's read lock
+        """
+        return json_chunks(self.rows(), chunk_rows, compact, self.reading)
+
+    def write_to(self, fileobj, chunk_rows=1000, compact=False):
+        """
+        Write the rows to fileobj as a JSON array, chunk_rows rows at a time
+        """
+        write_chunks(self.iter_json(chunk_rows, compact), fileobj)
+        return self
 
     def empty(self):
         return self.count() == 0
 
 
+class db_view:
+    """
+    Live result of a standing query, kept current by the writes to its
+    db_object: insert, update and remove only check the rows they touch.
+    Rows are held by reference, in table order (or sort order), and are
+    only copied when read.
+
+    callback(event, row) is called for each change to the view, where event
+    is 'added', 'changed' or 'removed' and row a copy of the row, or with
+    ('reset', None) after the db's rows were replaced wholesale. It runs
+    inside the write, so it may read the db but not write to it.
+
+    A sorted view leaves out rows lacking a sort key, or holding one that
+    can't be compared with the others' (or NaN), rather than fail the write
+    """
+    def __init__(self, db, query=None, sort=None, callback=None):
+        self._db = db
+        self._test = db.compile(query).test if query else (lambda row: True)
+        self.callback = callback
+        self._key = None
+        self._reverse = False
+        if sort:
+            # keyed on a tuple of the row's values, so entries don't change
+            # with the rows they came from
+            self._fields = list(sort.keys())
+            self._key, self._reverse = db_result.sort_key([(i, d) for i, d in enumerate(sort.values())])
+        self._entries = {}  # seq -> entry in _order
+        self._members = {}  # seq -> row
+        self._order = []    # (seq,) or (sort key, seq), ascending
+        self.reset(notify=False)
+
+    def entry(self, row, seq):
+        """
+        row's place in _order, or None if it has no place there
+        """
+        if self._key is None:
+            return (seq,)
+        try:
+            vals = tuple(row[k] for k in self._fields)
+        except KeyError:
+            return None
+        if any(val != val for val in vals):
+            return None # NaN: unordered against everything, it would break _order
+        key = self._key(vals)
+        # reversed views are read back to front: -seq keeps ties in table order
+        return (key, -seq if self._reverse else seq)
+
+    def reset(self, notify=True):
+        """
+        Rebuild from every row of the db
+        """
+        db = self._db
+        self._entries = {}
+        self._members = {}
+        self._order = []
+        matched = [(row, db._rowseq[id(row)]) for row in db._data if self._test(row)]
+        for row, seq in matched:
+            entry = self.entry(row, seq)
+            if entry is not None:
+                self._entries[seq] = entry
+                self._members[seq] = row
+        try:
+            self._order = sorted(self._entries.values())
+        except TypeError:
+            # keys that don't compare: add one at a time, leaving those out
+            self._entries = {}
+            self._members = {}
+            for row, seq in matched:
+                self._add(row, seq)
+        if notify and self.callback is not None:
+            self.callback('reset', None)
+
+    def track(self, row):
+        """
+        Bring row, just inserted or updated, into or out of the view
+        """
+        seq = self._db._rowseq[id(row)]
+        was = seq in self._members
+        if was:
+            self._drop(seq)
+        if self._test(row) and self._add(row, seq):
+            event = 'changed' if was else 'added'
+        elif was:
+            event = 'removed'
+        else:
+            return
+        if self.callback is not None:
+            self.callback(event, copy.deepcopy(row))
+
+    def untrack(self, row):
+        """
+        Take row, about to be removed from the db, out of the view
+        """
+        seq = self._db._rowseq.get(id(row))
+        if seq in self._members:
+            self._drop(seq)
+            if self.callback is not None:
+                self.callback('removed', copy.deepcopy(row))
+
+    def _add(self, row, seq):
+        """
+        Put row in the view. False if it has no place in the sort order
+        """
+        entry = self.entry(row, seq)
+        if entry is None:
+            return False
+        try:
+            bisect.insort(self._order, entry)
+        except TypeError:
+            return False
+        self._entries[seq] = entry
+        self._members[seq] = row
+        return True
+
+    def _drop(self, seq):
+        entry = self._entries.pop(seq)
+        del self._members[seq]
+        del self._order[bisect.bisect_left(self._order, entry)]
+
+    def rows(self):
+        """
+        The view's rows, in order, without copying them
+        """
+        with self._db._lock.reading():
+            order = reversed(self._order) if self._reverse else self._order
+            return [self._members[abs(entry[-1])] for entry in order]
+
+    @property
+    def data(self):
+        with self._db._lock.reading():
+            return copy.deepcopy(self.rows())
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self._order)
+
+    def count(self):
+        return len(self._order)
+
+    def close(self):
+        """
+        Stop keeping the view current
+        """
+        with self._db._mutex:
+            self._db._views.discard(self)
+
+
+class db_index:
+    """
+    Hash index over a single field: maps each value to the rows holding it.
+    Rows whose value can't be hashed (lists, dicts) are kept aside and
+    always returned as candidates, so callers must re-check them.
+    """
+    def __init__(self, field):
+        self.field = field
+        self.buckets = {}
+        self.unhashable = {}
+
+    def add(self, row, seq):
+        if self.field not in row:
+            return
+        try:
+            self.buckets.setdefault(row[self.field], {})[id(row)] = row
+        except TypeError:
+            self.unhashable[id(row)] = row
+
+    def discard(self, row, val, seq):
+        """
+        Drop row from the bucket of val, its value at the time it was indexed.
+        seq is the row's insertion sequence number
+        """
+        try:
+            bucket = self.buckets.get(val)
+        except TypeError:
+            self.unhashable.pop(id(row), None)
+            return
+        if bucket is not None:
+            bucket.pop(id(row), None)
+            if not bucket:
+                del self.buckets[val]
+
+    def add_many(self, rows, seqs):
+        for row, seq in zip(rows, seqs):
+            db_index.add(self, row, seq)
+
+    def discard_many(self, rows, seqs):
+        """
+        discard() for a batch of rows, each still holding its indexed value
+        """
+        field = self.field
+        for row, seq in zip(rows, seqs):
+            if field in row:
+                db_index.discard(self, row, row[field], seq)
+
+    def lookup(self, val):
+        """
+        Rows whose field equals val (unordered), or None if val can't be hashed
+        """
+        try:
+            bucket = self.buckets.get(val)
+        except TypeError:
+            return None
+        return list(bucket.values()) if bucket else []
+
+    def lookup_in(self, vals):
+        """
+        Rows whose field is in vals (unordered), or None if vals can't be hashed
+        """
+        res = {}
+        for val in vals:
+            try:
+                bucket = self.buckets.get(val)
+            except TypeError:
+                return None
+            if bucket:
+                res.update(bucket)
+        res.update(self.unhashable)
+        return list(res.values())
+
+
+class db_sorted_index(db_index):
+    """
+    Hash index that also keeps numbers and strings in two sorted runs of
+    (value, seq) keys, which is how the range comparators see them: they
+    never compare a number against a string, nor look at bools or None.
+    """
+    def __init__(self, field):
+        db_index.__init__(self, field)
+        self.nums = ([], [])    # (keys, rows)
+        self.strs = ([], [])
+        self.others = {}        # rows whose value is in neither run
+
+    def run_for(self, val):
+        if type(val) is type(1) or (type(val) is type(1.0) and val == val):
+            return self.nums # NaN would break the run's order: it goes to others
+        if type(val) is type(''):
+            return self.strs
+        return None
+
+    def add(self, row, seq):
+        db_index.add(self, row, seq)
+        if self.field not in row:
+            return
+        run = self.run_for(row[self.field])
+        if run is not None:
+            db_sorted_index.insert(run, (row[self.field], seq), row)
+        else:
+            self.others[id(row)] = row
+
+    @staticmethod
+    def insert(run, key, row):
+        pos = bisect.bisect_left(run[0], key)
+        run[0].insert(pos, key)
+        run[1].insert(pos, row)
+
+    def add_many(self, rows, seqs):
+        """
+        add() for a batch: the new keys are sorted once and merged into
+        each run, rather than inserted one at a time. A batch of under
+        1/128th of a run is still inserted a key at a time, which is cheaper
+        than rebuilding it
+        """
+        db_index.add_many(self, rows, seqs)
+        field = self.field
+        fresh = {id(self.nums): [], id(self.strs): []}
+        for row, seq in zip(rows, seqs):
+            if field in row:
+                run = self.run_for(row[field])
+                if run is not None:
+                    fresh[id(run)].append(((row[field], seq), row))
+                else:
+                    self.others[id(row)] = row
+        first = itemgetter(0)
+        for run in (self.nums, self.strs):
+            new = fresh[id(run)]
+            if len(new) * 128 < len(run[0]):
+                for key, row in new:
+                    db_sorted_index.insert(run, key, row)
+                continue
+            new.sort(key=first)
+            merged = list(heapq.merge(zip(run[0], run[1]), new, key=first))
+            run[0][:] = [key for key, row in merged]
+            run[1][:] = [row for key, row in merged]
+
+    def discard_many(self, rows, seqs):
+        """
+        discard() for a batch: each run is filtered in one pass, unless the
+        batch is under 1/128th of it, as in add_many()
+        """
+        db_index.discard_many(self, rows, seqs)
+        field = self.field
+        gone = {id(self.nums): {}, id(self.strs): {}}
+        for row, seq in zip(rows, seqs):
+            if field in row:
+                run = self.run_for(row[field])
+                if run is not None:
+                    gone[id(run)][id(row)] = (row[field], seq)
+                else:
+                    self.others.pop(id(row), None)
+        for run in (self.nums, self.strs):
+            old = gone[id(run)]
+            if len(old) * 128 < len(run[0]):
+                for key in old.values():
+                    pos = bisect.bisect_left(run[0], key)
+                    if pos < len(run[0]) and id(run[1][pos]) in old:
+                        del run[0][pos]
+                        del run[1][pos]
+                continue
+            kept = [(key, row) for key, row in zip(run[0], run[1]) if id(row) not in old]
+            run[0][:] = [key for key, row in kept]
+            run[1][:] = [row for key, row in kept]
+
+    def discard(self, row, val, seq):
+        db_index.discard(self, row, val, seq)
+        run = self.run_for(val)
+        if run is not None:
+            pos = bisect.bisect_left(run[0], (val, seq))
+            if pos < len(run[0]) and run[1][pos] is row:
+                del run[0][pos]
+                del run[1][pos]
+        else:
+            self.others.pop(id(row), None)
+
+    def prefixed(self, prefix):
+        """
+        Rows whose value, str()'d, could start with prefix: the strings in
+        prefix's stretch of the run, plus every row holding a non-string
+        """
+        keys, rows = self.strs
+        lo = bisect.bisect_left(keys, (prefix, 0))
+        if ord(prefix[-1]) < 0x10ffff:
+            hi = bisect.bisect_left(keys, (prefix[:-1] + chr(ord(prefix[-1]) + 1), 0))
+        else:
+            hi = len(keys)
+        res = rows[lo:hi]
+        if prefix[0] in '+-.0123456789in': # a number's str() starts with one of these
+            res.extend(self.nums[1])
+        res.extend(self.others.values())
+        return res
+
+    def range(self, conds):
+        """
+        Rows (in value order) satisfying every $lt/$lte/$gt/$gte in conds,
+        or None if the bounds don't share a number or string type
+        """
+        run = None
+        for val in conds.values():
+            r = self.run_for(val)
+            if r is None or (run is not None and r is not run):
+                return None
+            run = r
+        if run is None:
+            return None
+        keys = run[0]
+        lo, hi = 0, len(keys)
+        for cond, val in conds.items():
+            if cond in ('$gt', '$gte'):
+                if cond == '$gt':
+                    at = bisect.bisect_right(keys, (val, float('inf')))
+                else:
+                    at = bisect.bisect_left(keys, (val, 0))
+                lo = max(lo, at)
+            if cond in ('$lt', '$lte'):
+                if cond == '$lt':
+                    at = bisect.bisect_left(keys, (val, 0))
+                else:
+                    at = bisect.bisect_right(keys, (val, float('inf')))
+                hi = min(hi, at)
+        return run[1][lo:hi] if lo < hi else []
+
+    def ordered(self, run, reverse=False):
+        """
+        Rows of a sorted run, in sort order. Rows holding equal values keep
+        table order, also when reversed
+        """
+        keys, rows = run
+        if not reverse:
+            for row in rows:
+                yield row
+            return
+        end = len(keys)
+        while end > 0:
+            start = end - 1
+            while start > 0 and keys[start - 1][0] == keys[end - 1][0]:
+                start -= 1
+            for i in range(start, end):
+                yield rows[i]
+            end = start
+
+
+_missing = object()
+
+def canonical(val):
+    """
+    Hashable, type-exact form of a query value, used to key compiled queries.
+    Raises TypeError for values that can't take part in one
+    """
+    if type(val) is type({}):
+        return ('{', tuple((k, canonical(v)) for k, v in val.items()))
+    if type(val) is type([]) or type(val) is type(()):
+        return ('[', tuple(canonical(v) for v in val))
+    if type(val) is type(re.compile('')):
+        return ('re', val.pattern, val.flags)
+    hash(val)
+    return (type(val).__name__, val)
+
+
+class db_query:
+    """
+    A query dict compiled into a single predicate, test(row).
+
+    Each clause becomes one or more terms, {'key','op','val','cost','test'}.
+    The AND of the terms is checked cheapest first and stops at the first
+    term a row fails.
+    """
+    COSTS = {'EQ':1, '$exists':1, '$ne':1, '$eq':1,
+             '$lt':2, '$lte':2, '$gt':2, '$gte':2,
+             '$in':3, '$nin':3, 'REGEX':4, 'OR':5}
+    REGEX_OPTIONS = {'i':re.IGNORECASE, 'm':re.MULTILINE, 's':re.DOTALL, 'x':re.VERBOSE}
+
+    def __init__(self, db, clauses):
+        self.clauses = clauses
+        self.key = None     # canonical form, when the query could be cached
+        self.terms = []
+        for key, val in clauses.items():
+            self.terms.extend(db_query.compile_clause(db, key, val))
+        self.terms.sort(key=lambda t: t['cost'])
+        self.test = db_query.all_of([t['test'] for t in self.terms])
+        self._residual = {}
+
+    def residual(self, served):
+        """
+        Predicate over every term except the positions in served
+        """
+        served = frozenset(served)
+        if served not in self._residual:
+            tests = [t['test'] for i, t in enumerate(self.terms) if i not in served]
+            self._residual[served] = db_query.all_of(tests)
+        return self._residual[served]
+
+    @staticmethod
+    def all_of(tests):
+        if not tests:
+            return lambda row: True
+        if len(tests) == 1:
+            return tests[0]
+        def test(row):
+            for t in tests:
+                if not t(row):
+                    return False
+            return True
+        return test
+
+    @staticmethod
+    def compile_clause(db, key, val, loose=False):
+        """
+        Terms for one key:val clause. loose is the $or flavour, where a
+        missing key reads as None instead of failing the clause
+        """
+        _t = db.detect_clause_type(key, val)
+        terms = []
+        if _t == 'NORMAL' or _t == 'SUBDOCUMENT': # <- subdoc compares whole value until we implement it
+            if type(val) is type(re.compile('')):
+                terms.append(db_query.regex_term(key, val, loose))
+            else:
+                if loose:
+                    test = lambda row: row.get(key) == val
+                else:
+                    test = lambda row: row.get(key, _missing) == val
+                terms.append({'key':key, 'op':'EQ', 'val':val, 'cost':db_query.COSTS['EQ'], 'test':test})
+        elif _t == 'CONDITIONAL':
+            for cond, arg in val.items():
+                if cond == '$regex':
+                    options = val.get('$options', '')
+                    if type(arg) is type(''):
+                        arg = db_query.regex(arg, options)
+                    elif options:
+                        # a compiled pattern takes the options on top of its own flags
+                        arg = db_query.regex(arg.pattern, options, arg.flags)
+                    terms.append(db_query.regex_term(key, arg, loose))
+                    continue
+                compare = db.comparators.get(cond)
+                if compare is not None:
+                    terms.append({'key':key, 'op':cond, 'val':arg, 'cost':db_query.COSTS.get(cond, 2),
+                                  'test':db_query.compile_cond(key, cond, arg, compare, loose)})
+        elif _t == 'OR' and not loose:
+            branches = []
+            for elt in val:
+                eltkey = list(elt.keys())[0]
+                found = db_query.compile_clause(db, eltkey, elt[eltkey], True)
+                if found:
+                    branches.append(db_query.all_of([t['test'] for t in found]))
+            def test(row):
+                for branch in branches:
+                    if branch(row):
+                        return True
+                return False
+            terms.append({'key':key, 'op':'OR', 'val':val, 'cost':db_query.COSTS['OR'] + len(branches), 'test':test})
+        return terms
+
+    @staticmethod
+    def regex_term(key, pattern, loose):
+        """
+        Term matching rows whose value, str()'d unless it is a string
+        already, pattern.match()es. Its 'prefix' is the literal text those
+        values must start with, for an ordered index to serve
+        """
+        match = pattern.match
+        if loose:
+            test = lambda row: row.get(key) is not None and \
+                    match(row[key] if type(row[key]) is type('') else str(row[key])) is not None
+        else:
+            test = lambda row: key in row and \
+                    match(row[key] if type(row[key]) is type('') else str(row[key])) is not None
+        return {'key':key, 'op':'REGEX', 'val':pattern, 'cost':db_query.COSTS['REGEX'], 'test':test,
+                'prefix':db_query.literal_prefix(pattern)}
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def regex(pattern, options='', flags=0):
+        """
+        Compiled pattern of a {'$regex':pattern, '$options':'imsx'} clause,
+        with flags as well
+        """
+        for c in options:
+            if c not in db_query.REGEX_OPTIONS:
+                raise Exception('db_object: unknown $regex option {}'.format(c))
+            flags |= db_query.REGEX_OPTIONS[c]
+        return re.compile(pattern, flags)
+
+    @staticmethod
+    def literal_prefix(pattern):
+        """
+        Literal text at the start of pattern that every string it matches
+        begins with, or '' if there is none we can be sure of
+        """
+        src = pattern.pattern
+        if type(src) is not type('') or pattern.flags & (re.IGNORECASE | re.VERBOSE) or '|' in src:
+            return ''
+        i = 1 if src.startswith('^') else 2 if src.startswith('\\A') else 0
+        prefix = []
+        while i < len(src):
+            c = src[i]
+            step = 1
+            if c == '\\':
+                if src[i+1:i+2] == '' or src[i+1].isalnum():
+                    break # a class like \d, or a backreference
+                c = src[i+1]
+                step = 2
+            elif c in '.^$*+?{}[]()':
+                break
+            if src[i+step:i+step+1] in ('*', '?', '{'):
+                break # c may not be there at all
+            prefix.append(c)
+            i += step
+        return ''.join(prefix)
+
+    @staticmethod
+    def compile_cond(key, cond, arg, compare, loose):
+        if loose:
+            return lambda row: compare(row.get(key), arg)
+        if cond == '$exists':
+            want = bool(arg)
+            return lambda row: bool(row.get(key)) == want
+        if cond == '$ne':
+            # rows lacking the key (or holding a falsy value) count as not equal
+            return lambda row: not row.get(key) or row.get(key) != arg
+        if (cond == '$in' or cond == '$nin') and type(arg) is type([]):
+            try:
+                fast = frozenset(arg)
+            except TypeError:
+                fast = None
+            def member(v):
+                if fast is not None:
+                    try:
+                        return v in fast
+                    except TypeError:
+                        pass
+                return v in arg
+            if cond == '$in':
+                return lambda row: key in row and member(row[key])
+            return lambda row: key in row and not member(row[key])
+        return lambda row: key in row and compare(row[key], arg)
+
+
+class db_rwlock:
+    """
+    Readers-writer lock: any number of readers, or one writer. Re-entrant: the
+    writing thread may take either lock again, and a reader may read again.
+    Waiting writers hold off new readers, so writes aren't starved.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writes = 0
+        self._waiting = 0
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def reading(self):
+        if self._writer == threading.get_ident():
+            yield # the write lock already covers it
+            return
+        held = getattr(self._local, 'reads', 0)
+        with self._cond:
+            if not held:
+                while self._writer is not None or self._waiting:
+                    self._cond.wait()
+            self._readers += 1
+        self._local.reads = held + 1
+        try:
+            yield
+        finally:
+            self._local.reads = held
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def writing(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                if getattr(self._local, 'reads', 0):
+                    raise Exception('db_rwlock: can not write while reading')
+                self._waiting += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting -= 1
+                self._writer = me
+            self._writes += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writes -= 1
+                if not self._writes:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+def _reads(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._lock.reading():
+            return method(self, *args, **kwargs)
+    return locked
+
+def _writes(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._lock.writing():
+            return method(self, *args, **kwargs)
+    return locked
+
+def _read_only(self, *args, **kwargs):
+    raise Exception('{}: read-only'.format(type(self).__name__))
+
+
+# id(db_object) -> db_object, as seen by forked scan workers. Weak: a db
+# that is let go of takes its worker pool down with it (see worker_pool)
+_scan_sources = weakref.WeakValueDictionary()
+
+def _scan_part(source, clauses, lo, hi):
+    """
+    Worker side of a parallel scan: positions in [lo, hi) of the rows
+    matching clauses
+    """
+    db = _scan_sources[source]
+    test = db_query(db, clauses).test
+    data = db._data
+    return [i for i in range(lo, hi) if test(data[i])]
+
+
+class db_codec:
+    """
+    Turns rows into bytes and back for load/save. JSON goes through orjson
+    when it is installed and can lay the file out as asked (compact, or
+    indent=2), else through json. orjson writes non-ASCII text as UTF-8
+    rather than \\u escapes; rows holding NaN or Infinity, which orjson
+    would write as null, go through json. db_codec(fast=False) keeps to json.
+
+    The binary snapshot format is marshal behind a header naming the format
+    version and the marshal version, for fast restarts. Like JSON it holds
+    dicts, lists, strings, numbers, bools and None.
+    """
+    SNAP_MAGIC = b'QRYSNAP'
+    SNAP_VERSION = 1
+
+    def __init__(self, fast=True):
+        self.fast = fast and orjson is not None
+
+    def loads(self, data):
+        if self.fast:
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass # NaN/Infinity, which only json reads
+        return json.loads(data)
+
+    def dumps(self, obj, jsonarg=None):
+        """
+        obj as JSON bytes, laid out as json.dumps(obj, **jsonarg) would.
+        Compact by default
+        """
+        if jsonarg is None:
+            jsonarg = {'separators':(',',':')}
+        if self.fast:
+            option = None
+            if jsonarg == {'separators':(',',':')}:
+                option = 0
+            elif jsonarg == {'indent':2}:
+                option = orjson.OPT_INDENT_2
+            if option is not None:
+                try:
+                    out = orjson.dumps(obj, option=option)
+                except TypeError:
+                    out = None # non-string keys, huge ints: json copes with those
+                # a null may be a NaN or Infinity that orjson dropped
+                if out is not None and (b'null' not in out or db_codec.finite(obj)):
+                    return out
+        return json.dumps(obj, **jsonarg).encode('utf-8')
+
+    @staticmethod
+    def finite(obj):
+        """
+        False if obj holds a NaN or Infinity float anywhere
+        """
+        stack = [obj]
+        while stack:
+            val = stack.pop()
+            if type(val) is type({}):
+                stack.extend(val.values())
+            elif type(val) is type([]) or type(val) is type(()):
+                stack.extend(val)
+            elif type(val) is type(1.0) and not math.isfinite(val):
+                return False
+        return True
+
+    def is_snap(self, head):
+        return head[:len(db_codec.SNAP_MAGIC)] == db_codec.SNAP_MAGIC
+
+    def snap_dumps(self, obj):
+        header = db_codec.SNAP_MAGIC + bytes([db_codec.SNAP_VERSION, marshal.version])
+        return header + marshal.dumps(obj, marshal.version)
+
+    def snap_loads(self, data):
+        n = len(db_codec.SNAP_MAGIC)
+        if not self.is_snap(data) or len(data) < n + 2:
+            raise Exception('db_codec: not a snapshot')
+        if data[n] != db_codec.SNAP_VERSION or data[n+1] > marshal.version:
+            raise Exception('db_codec: snapshot version {}/{} not readable here'.format(data[n], data[n+1]))
+        return marshal.loads(data[n+2:])
+
+
 class db_object:
-    def __init__(self, jsonarg=None, auto_index='_id', path=None, data=None):
+    query_cache_size = 256   # compiled queries kept per db_object
+    codec = db_codec()       # load/save serialization, see db_codec
+
+    def __init__(self, jsonarg=None, auto_index='_id', path=None, data=None,
+                 journal=False, journal_limit=10000, fmt=None, result_cache=0,
+                 workers=0, parallel_threshold=100000):
         """
         jsonarg:    Set json output attributes, else if True yields human readable.
                     Default is minified
 
         auto_index: Can override default automatic index. Default: '_id'
 
+        journal:    If True, save() appends the inserts, updates and removes made
+                    since the last save to a sidecar log (path + '.journal')
+                    instead of rewriting the whole file. load() replays the log
+        journal_limit: save() compacts the log back into the file once it holds
+                    more than this many records
+
+        fmt:        'json' (one array) or 'jsonl' (one row per line, read and
+                    written a row at a time). Default: 'jsonl' for paths ending
+                    in .jsonl, else 'json'
+
+        result_cache: Keep the rows of up to this many find()/distinct() calls,
+                    keyed by query and sort/skip/limit, until the next write.
+                    Default 0: off. See cache_info()
+
+        workers:    Scan with this many worker processes once there are at least
+                    parallel_threshold rows. Workers are forked, so they see the
+                    rows without them being pickled; needs the 'fork' start method.
+                    Default 0: off
+
         3 ways to get data into db:
             - data()   - passes in raw and doesn't alter fields (won't inject _id)
             - insert() - inserts each row, altering as normal (may inject _id)
@@ -117,6 +1229,30 @@ class db_object:
         else:
             self._jsonarg = {'indent':2}
         self.auto_index = auto_index
+        self._indexes = {}
+        self._rowseq = {}   # id(row) -> insertion sequence, kept while indexed or viewed
+        self._seq = 0
+        self._queries = OrderedDict()
+        self._journal = [] if journal else None    # records not yet on disk
+        self._journal_count = 0     # records in the journal file
+        self._journal_stale = True  # file on disk doesn't hold our base state
+        self.journal_limit = journal_limit
+        self._fmt = fmt
+        self._gen = 0       # write generation, bumped by every change to the rows
+        self._results = OrderedDict() if result_cache else None
+        self._result_cache = result_cache
+        self._hits = 0
+        self._misses = 0
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self._pool = None
+        self._pool_gen = None
+        self._pool_done = None  # finalizer shutting _pool down
+        self._lock = db_rwlock()
+        self._mutex = threading.Lock()  # guards the caches, which readers fill
+        self._snapshots = weakref.WeakSet()
+        self._views = weakref.WeakSet()
+        self._slow = None   # (callback, ms), see on_slow_query()
 
         def verify(a,b):
             if type(a) is type(None) or type(a) is type(False):
@@ -136,7 +1272,9 @@ class db_object:
                             '$eq': lambda a, b: a == b,
                             '$exists': lambda a, b: bool(a) == bool(b),
                             '$in': lambda a, b: a in b,
-                            '$nin': lambda a, b: a not in b}
+                            '$nin': lambda a, b: a not in b,
+                            '$regex': lambda a, b: a is not None and
+                                (db_query.regex(b) if type(b) is type('') else b).match(str(a)) is not None}
 
     def setPath(self, _path):
         """
@@ -149,6 +1287,7 @@ class db_object:
     def path(self):
         return self._path
 
+    @_writes
     def data(self, _data):
         """
         Populate the database with data. Can be both/either string or ``list of dict''
@@ -164,8 +1303,12 @@ class db_object:
             for row in self._data:
                 if self.auto_index not in row:
                     row[ self.auto_index ] = self.new_index()
+        self._reindex()
+        self._rebased()
+        self._changed()
         return self
 
+    @_writes
     def load(self, path=False):
         """
         Load from file.
@@ -180,20 +1323,24 @@ class db_object:
         # Try reading the path, if not found write initial data instead of throwing error.
         # We need to know if it is a bad path, or we set our path incorrectly. Not if we can't
         # open it the first time because its not there. Forcing behavior where we .save().load()
-        # in the client is stupid, so we'll do it for them here instead
+        # in the client is stupid, so we'll do it for them here instead.
+        # A file that is there but can't be read is left alone: the error is raised
         try:
-            with open(self._path, 'r') as f:
-                self._data = json.load(f)
-        except:
+            self._data = self.read_rows()
+        except FileNotFoundError:
             self.save()
-            with open(self._path, 'r') as f:
-                self._data = json.load(f)
+            self._data = self.read_rows()
+        if self._journal is not None:
+            self.replay()
 
         for x in (row.get('_id') for row in self._data if row.get('_id') is not None):
             if x > self._id:
                 self._id = x
+        self._reindex()
+        self._changed()
         return self
 
+    @_writes
     def save(self, path=False, jsonarg=None):
         """
         Save to file.
@@ -202,47 +1349,483 @@ class db_object:
         jsonarg:    can override json formatting arguments for this save if desired
         """
         self.setPath(path)
+        if self._journal is not None:
+            if self._journal_stale or path or jsonarg is not None or \
+                    self._journal_count + len(self._journal) > self.journal_limit:
+                return self.compact(jsonarg)
+            if self._journal:
+                if self._journal_count == 0:
+                    # tie the log to the file it applies to
+                    self._journal.insert(0, json.dumps({'op':'base','size':os.path.getsize(self._path)}))
+                with open(self.journal_path(), 'a') as f:
+                    f.write(''.join(rec + '\n' for rec in self._journal))
+                self._journal_count += len(self._journal)
+                self._journal = []
+            return self
+        self.write_rows(jsonarg)
+        return self
+
+    def fmt(self):
+        """
+        File format: 'json', 'jsonl' or 'snap' (binary snapshot), by the fmt
+        argument or else the path's extension. Reading goes by the file's
+        header first, so a snapshot loads whatever its name
+        """
+        if self._fmt:
+            return self._fmt
+        if self._path.endswith('.jsonl'):
+            return 'jsonl'
+        if self._path.endswith('.snap'):
+            return 'snap'
+        return 'json'
+
+    def read_rows(self):
+        with open(self._path, 'rb') as f:
+            head = f.read(len(db_codec.SNAP_MAGIC))
+            if self.codec.is_snap(head):
+                return self.codec.snap_loads(head + f.read())
+            if self.fmt() != 'jsonl':
+                return self.codec.loads(head + f.read())
+        # jsonl is parsed a line at a time, never held whole
+        return list(self.iter_file())
+
+    def iter_file(self):
+        """
+        Yield the rows of a jsonl file one at a time
+        """
+        with open(self._path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield self.codec.loads(line)
+
+    def write_rows(self, jsonarg=None):
+        """
+        Write every row to the file. Returns False, leaving the file as it
+        was, if the rows can't be serialized
+        """
         ja = jsonarg if jsonarg is not None else self._jsonarg
+        fmt = self.fmt()
+        if fmt == 'jsonl' or fmt == 'snap':
+            # stream into a side file, swapped in once complete
+            tmp = self._path + '.tmp'
+            try:
+                with open(tmp, 'wb') as f:
+                    if fmt == 'snap':
+                        f.write(self.codec.snap_dumps(self._data))
+                    else:
+                        for row in self._data:
+                            f.write(self.codec.dumps(row))
+                            f.write(b'\n')
+            except:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return False
+            os.replace(tmp, self._path)
+            return True
         try:
-            formatted = json.dumps(self._data, **ja)
-            with open(self._path, 'w') as f:
+            formatted = self.codec.dumps(self._data, ja)
+            with open(self._path, 'wb') as f:
                 f.write(formatted)
         except:
-            pass # catch so badly formatted json doesn't overwrite & erase db
+            return False # catch so badly formatted json doesn't overwrite & erase db
+        return True
+
+    def journal_path(self):
+        return self._path + '.journal'
+
+    @_writes
+    def compact(self, jsonarg=None):
+        """
+        Rewrite the whole file and fold the journal into it
+        """
+        if not self.write_rows(jsonarg):
+            return self
+        if os.path.exists(self.journal_path()):
+            os.remove(self.journal_path())
+        if self._journal is not None:
+            self._journal = []
+            self._journal_count = 0
+            self._journal_stale = False
         return self
 
-    def insert(self, row_or_ary):
+    def replay(self):
         """
-        Insert a row (dict), or array or rows (list of dict)
+        Apply the journal, if any, over rows just read from the file
+        """
+        self._journal = []
+        self._journal_count = 0
+        self._journal_stale = False
+        try:
+            with open(self.journal_path(), 'r') as f:
+                lines = f.readlines()
+        except IOError:
+            return self
+        for line in lines:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                break # torn last write
+            op = rec.get('op')
+            if op == 'base':
+                if rec.get('size') != os.path.getsize(self._path):
+                    break # file was rewritten since, log is already folded in
+            elif op == 'i':
+                self._data.append(rec['row'])
+            elif op == 'u':
+                self._data[rec['at']].update(rec['set'])
+            elif op == 'r':
+                gone = set(rec['at'])
+                self._data[:] = [row for i, row in enumerate(self._data) if i not in gone]
+            self._journal_count += 1
+        return self
+
+    def _changed(self):
+        """
+        Note a write to the rows: every cached result is stale from here on
+        """
+        self._gen += 1
+        if self._results:
+            self._results.clear()
+
+    def cached(self, key, compute):
         """
-        def insert_one(self, row):
-            assert type(row) is type({})
-            if self.auto_index and self.auto_index not in row:
-                row[ self.auto_index ] = self.new_index()
-            self._data.append(row)
+        compute() from the result cache under key, if enabled
+        """
+        if self._results is None:
+            return compute()
+        with self._mutex:
+            hit = self._results.get(key)
+            if hit is not None and hit[0] == self._gen:
+                self._hits += 1
+                self._results.move_to_end(key)
+                return hit[1]
+            self._misses += 1
+            gen = self._gen
+        res = compute()
+        with self._mutex:
+            self._results[key] = (gen, res)
+            if len(self._results) > self._result_cache:
+                self._results.popitem(last=False)
+        return res
+
+    def cache_info(self):
+        """
+        Result cache counters, for tuning its size
+        """
+        return {'hits':self._hits, 'misses':self._misses,
+                'size':len(self._results) if self._results is not None else 0,
+                'maxsize':self._result_cache}
+
+    def log(self, rec):
+        self._journal.append(json.dumps(rec, separators=(',',':')))
 
-            # replace any 'now()' value strings with the current timestamp
-            if 'now()' in row.values():
-                for k, v in row.items():
-                    if v == 'now()':
-                        row[k] = datetime.strftime(datetime.now(),'%Y-%m-%dT%H:%M:%S.%f%z')
+    def _rebased(self):
+        """
+        _data was replaced wholesale: the journal can't express it, next save rewrites
+        """
+        if self._journal is not None:
+            self._journal = []
+            self._journal_stale = True
 
+    @_writes
+    def insert(self, row_or_ary):
+        """
+        Insert a row (dict), or array or rows (list of dict)
+        """
         if type(row_or_ary) is type([]):
-            for row in row_or_ary:
-                insert_one(self, row)
+            return self.insert_many(row_or_ary)
         elif type(row_or_ary) is type({}):
-            insert_one(self, row_or_ary)
+            return self.insert_many([row_or_ary])
         else:
             raise Exception('db_object: insert: bad type')
+
+    @_writes
+    def insert_many(self, rows, validate=True, stamp=True):
+        """
+        Insert a list of rows as one batch: _ids are handed out as a block,
+        the 'now()' timestamp is taken once, and indexes are updated together
+
+        validate: False skips checking that every row is a dict, for trusted input
+        stamp:    False skips looking for 'now()' values to replace
+        """
+        if validate:
+            if type(rows) is not type([]):
+                raise Exception('db_object: insert_many: bad type')
+            for row in rows:
+                if type(row) is not type({}):
+                    raise Exception('db_object: insert_many: bad type')
+        if not rows:
+            return self
+
+        ai = self.auto_index
+        if ai:
+            fresh = [row for row in rows if ai not in row]
+            base = self._id
+            self._id += len(fresh)
+            for n, row in enumerate(fresh, base + 1):
+                row[ai] = n
+
+        # replace any 'now()' value strings with the current timestamp
+        if stamp:
+            now = None
+            for row in rows:
+                if 'now()' in row.values():
+                    if now is None:
+                        now = datetime.strftime(datetime.now(),'%Y-%m-%dT%H:%M:%S.%f%z')
+                    for k, v in row.items():
+                        if v == 'now()':
+                            row[k] = now
+
+        self._data.extend(rows)
+        if self._sequenced():
+            seqs = range(self._seq + 1, self._seq + len(rows) + 1)
+            self._seq += len(rows)
+            for row, seq in zip(rows, seqs):
+                self._rowseq[id(row)] = seq
+            for index in self._indexes.values():
+                index.add_many(rows, seqs)
+            for view in list(self._views):
+                for row in rows:
+                    view.track(row)
+        self._changed()
+        if self._journal is not None:
+            for row in rows:
+                self.log({'op':'i','row':row})
         return self
 
+    @_writes
+    def create_index(self, field, ordered=False):
+        """
+        Build an index on field. It is kept current by every write, and
+        find/remove/update use it for equality and $in clauses on field
+
+        ordered: also keep the values sorted, serving $lt/$lte/$gt/$gte
+                 and db_result.sort() on field
+        """
+        assert type(field) is type('')
+        if not self._sequenced():
+            self._renumber()
+        index = db_sorted_index(field) if ordered else db_index(field)
+        for row in self._data:
+            index.add(row, self._rowseq[id(row)])
+        self._indexes[field] = index
+        return self
+
+    @_writes
+    def drop_index(self, field):
+        """
+        Remove the index on field, if any
+        """
+        self._indexes.pop(field, None)
+        if not self._sequenced():
+            self._rowseq = {}
+        return self
+
+    def _reindex(self):
+        """
+        Re-index every row, after _data was replaced wholesale
+        """
+        if self._sequenced():
+            self._renumber()
+            for field, old in list(self._indexes.items()):
+                index = type(old)(field)
+                for row in self._data:
+                    index.add(row, self._rowseq[id(row)])
+                self._indexes[field] = index
+            for view in list(self._views):
+                view.reset()
+        return self
+
+    def _sequenced(self):
+        """
+        Rows carry sequence numbers in _rowseq while indexes or views need them
+        """
+        return bool(self._indexes) or bool(self._views)
+
+    def _renumber(self):
+        self._seq = 0
+        self._rowseq = {}
+        for row in self._data:
+            self._seq += 1
+            self._rowseq[id(row)] = self._seq
+
+    def _track(self, row):
+        self._seq += 1
+        self._rowseq[id(row)] = self._seq
+        for index in self._indexes.values():
+            index.add(row, self._seq)
+
+    def _untrack(self, row):
+        seq = self._rowseq.pop(id(row), None)
+        for field, index in self._indexes.items():
+            if field in row:
+                index.discard(row, row[field], seq)
+
+    def _untrack_many(self, rows):
+        seqs = [self._rowseq.pop(id(row), None) for row in rows]
+        for index in self._indexes.values():
+            index.discard_many(rows, seqs)
+
+    def index_scan(self, query):
+        """
+        Pick the indexed terms of a compiled query with the fewest candidate
+        rows: equality and $in from any index, ranges from an ordered one.
+        Returns (candidates in table order, predicate for the other terms),
+        or None if no term can be served from an index
+        """
+        plan = self.index_plan(query)
+        if plan is None:
+            return None
+        rows, served, field = plan
+        return rows, query.residual(served)
+
+    def index_plan(self, query):
+        """
+        index_scan's choice, as (candidates in table order, positions of the
+        terms they satisfy, indexed field), or None
+        """
+        best = None
+        for key, index in self._indexes.items():
+            bounds = {}
+            for i, term in enumerate(query.terms):
+                if term['key'] != key:
+                    continue
+                rows = None
+                exact = True
+                if term['op'] == 'EQ' or term['op'] == '$eq':
+                    rows = index.lookup(term['val'])
+                elif term['op'] == '$in' and type(term['val']) is type([]):
+                    rows = index.lookup_in(term['val'])
+                    exact = not index.unhashable
+                elif term['op'] in ('$lt', '$lte', '$gt', '$gte'):
+                    bounds[term['op']] = (i, term['val'])
+                elif term['op'] == 'REGEX' and term['prefix'] and isinstance(index, db_sorted_index):
+                    rows = index.prefixed(term['prefix'])
+                    exact = False # candidates only: the pattern still runs over them
+                if rows is not None and (best is None or len(rows) < len(best[0])):
+                    best = (rows, [i] if exact else [], key)
+            if bounds and isinstance(index, db_sorted_index):
+                rows = index.range({op: v for op, (i, v) in bounds.items()})
+                if rows is not None and (best is None or len(rows) < len(best[0])):
+                    best = (rows, [i for i, v in bounds.values()], key)
+        if best is None:
+            return None
+        best[0].sort(key=lambda row: self._rowseq[id(row)])
+        return best
+
+    def index_order(self, field, reverse=False):
+        """
+        Every row, in sort order on field, walked off an ordered index.
+        None unless field has one and all rows hold a value in one sorted run
+        """
+        index = self._indexes.get(field)
+        if not isinstance(index, db_sorted_index):
+            return None
+        for run in (index.nums, index.strs):
+            if run[0] and len(run[0]) == len(self._data):
+                return index.ordered(run, reverse)
+        return None
+
+    def parallel_scan(self, query):
+        """
+        Rows of _data matching query, in order, found by the worker processes.
+        None when the scan should run here instead
+        """
+        if self.workers < 2 or len(self._data) < self.parallel_threshold:
+            return None
+        pool = self.worker_pool()
+        if pool is None:
+            return None
+        n = len(self._data)
+        step = -(-n // (self.workers * 4))
+        try:
+            parts = [pool.submit(_scan_part, id(self), query.clauses, lo, min(lo + step, n))
+                     for lo in range(0, n, step)]
+            hits = [part.result() for part in parts]
+        except Exception:
+            with self._mutex:
+                self.close_workers()
+            return None
+        data = self._data
+        return [data[i] for part in hits for i in part]
+
+    def worker_pool(self):
+        """
+        Process pool forked since the last write, so its workers hold our rows
+        """
+        with self._mutex:
+            if self._pool is not None and self._pool_gen == self._gen:
+                return self._pool
+            self.close_workers()
+            try:
+                context = multiprocessing.get_context('fork')
+            except ValueError:
+                return None
+            _scan_sources[id(self)] = self
+            self._pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+            self._pool_gen = self._gen
+            self._pool_done = weakref.finalize(self, self._pool.shutdown, wait=False)
+            return self._pool
+
+    def close_workers(self):
+        """
+        Shut down the worker processes of parallel scans, if any
+        """
+        if self._pool is not None:
+            self._pool_done()
+            self._pool = None
+        _scan_sources.pop(id(self), None)
+        return self
+
+    def compile(self, clauses):
+        """
+        Compile a query dict into a db_query. Compiled queries are cached by
+        the canonical form of the dict, so repeated queries skip parsing
+        """
+        try:
+            key = canonical(clauses)
+        except TypeError:
+            return db_query(self, clauses)
+        with self._mutex:
+            query = self._queries.get(key)
+            if query is not None:
+                self._queries.move_to_end(key)
+                return query
+        query = db_query(self, copy.deepcopy(clauses))
+        query.key = key
+        with self._mutex:
+            self._queries[key] = query
+            if len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return query
+
     def new_index(self):
         self._id = self._id + 1
         return self._id
 
+    @_reads
     def toString(self,compact=True):
-        xa = {'separators':(',',':')} if compact else {'indent':2}
-        return json.dumps(self.data, **xa)
+        return ''.join(json_chunks(self._data, len(self._data) or 1, compact))
+
+    def iter_json(self, chunk_rows=1000, compact=True):
+        """
+        Every row as a JSON array, in pieces of chunk_rows rows, see json_chunks().
+        It reads from a snapshot, so writes can go on while the pieces are taken
+        """
+        if type(self._data) is type([]):
+            snap = self.snapshot()
+            rows = snap._data
+        else:
+            rows = self._data # read-only rows, as in db_archive
+        for chunk in json_chunks(rows, chunk_rows, compact):
+            yield chunk
+
+    def write_to(self, fileobj, chunk_rows=1000, compact=True):
+        """
+        Write every row to fileobj as a JSON array, chunk_rows rows at a time
+        """
+        write_chunks(self.iter_json(chunk_rows, compact), fileobj)
+        return self
 
     def detect_clause_type(self, key, val):
         if type(val) is type(True) or \
@@ -254,8 +1837,8 @@ class db_object:
         elif type(val) is type(''):
             return 'SUBDOCUMENT' if '.' in val else 'NORMAL'
         elif type(val) is type({}):
-            k = list(val.keys())[0]
-            if k in self.comparators:
+            # any operator makes it conditional: {'$options':..., '$regex':...}
+            if any(k in self.comparators for k in val):
                 return 'CONDITIONAL'
             return 'SUBDOCUMENT'
         elif type(val) is type([]):
@@ -278,7 +1861,8 @@ class db_object:
                 if key == test['key']:
                     # regex: equiv to SQL "like" statement
                     if type(test['val']) is type(re.compile('')):
-                        if re.match(test['val'], str(row[key])):
+                        val = row[key]
+                        if test['val'].match(val if type(val) is type('') else str(val)):
                             res.append( row )
                             next_row = True
                     # compare number, date, string statements directly
@@ -350,8 +1934,9 @@ class db_object:
                 _t = self.detect_clause_type( eltkey, eltval )
                 if _t == 'NORMAL' or _t == 'SUBDOCUMENT': # <- subdoc is hack until we implement handling case
                     if type(test['val']) is type(re.compile('')):
-                        if row.get(test['key']) is not None and \
-                                test['val'].match(str(row[test['key']])):
+                        val = row.get(test['key'])
+                        if val is not None and \
+                                test['val'].match(val if type(val) is type('') else str(val)):
                             res.append(row)
                             break # goto scanning next row so we dont double add this one
                     elif row.get(test['key']) == test['val']:
@@ -366,42 +1951,224 @@ class db_object:
 
         return res
 
+    def iter_query(self, master, clauses, stats=None, parallel=True):
+        """
+        Lazily yield the rows of master matching clauses, in order
+
+        stats:    dict to set 'scanned' in, the number of rows the plan starts from
+        parallel: False keeps the scan here, for callers that stop early
+        """
+        query = self.compile(clauses)
+        test = query.test
+        if self._indexes and master is self._data:
+            scanned = self.index_scan(query)
+            if scanned is not None:
+                master, test = scanned
+        if stats is not None:
+            stats['scanned'] = len(master)
+        if parallel and master is self._data:
+            scanned = self.parallel_scan(query)
+            if scanned is not None:
+                return iter(scanned)
+        return filter(test, master)
+
+    @_reads
     def do_query(self, master, clauses):
-        result = master
-        for key, val in clauses.items():
-            _t = self.detect_clause_type(key, val)
-            if _t == 'NORMAL' or _t == 'SUBDOCUMENT': # <- sub is hack until we implement handling case
-                result = self.match_rows_NORMAL(result, {'key':key,'val':val})
-            elif _t == 'CONDITIONAL':
-                result = self.match_rows_CONDITIONAL(result, {'key':key,'val':val})
-            elif _t == 'OR':
-                result = self.match_rows_OR(result, val)
-        return result
+        if self._slow is None:
+            return list(self.iter_query(master, clauses))
+        start = time.perf_counter()
+        stats = {}
+        res = list(self.iter_query(master, clauses, stats))
+        self.timed('query', clauses, start, stats['scanned'], len(res))
+        return res
 
-    def find(self, match=None):
+    def on_slow_query(self, callback, ms=100):
+        """
+        Call callback(info) for every query that takes at least ms milliseconds.
+        info: {'op', 'query', 'ms', 'rows_scanned', 'rows_returned'}, where
+        rows_scanned counts the rows the plan started from. None turns it off
+        """
+        self._slow = (callback, ms) if callback is not None else None
+        return self
+
+    def timed(self, op, query, start, scanned, returned):
+        """
+        Hand a query that ran since start (a perf_counter reading) to the
+        slow query callback, if it took long enough
+        """
+        ms = (time.perf_counter() - start) * 1000
+        slow = self._slow
+        if slow is not None and ms >= slow[1]:
+            slow[0]({'op':op, 'query':query, 'ms':ms,
+                     'rows_scanned':scanned, 'rows_returned':returned})
+
+    @_reads
+    def explain(self, clauses):
+        """
+        Run a query one stage at a time and report how it went: the type
+        detect_clause_type gave each clause, the index used if any, and for
+        each stage, in execution order, the rows in and out and the time taken
+        """
+        begin = time.perf_counter()
+        query = self.compile(clauses)
+        res = {'query':clauses,
+               'clauses':[{'key':k, 'type':self.detect_clause_type(k, v)} for k, v in clauses.items()],
+               'index':None,
+               'parallel':False,
+               'stages':[]}
+        rows = self._data
+        served = []
+        start = time.perf_counter()
+        plan = self.index_plan(query) if self._indexes else None
+        if plan is not None:
+            rows, served, field = plan
+            res['index'] = field
+            res['stages'].append({'stage':'index', 'key':field,
+                                  'ops':[query.terms[i]['op'] for i in served],
+                                  'rows_in':len(self._data), 'rows_out':len(rows),
+                                  'ms':(time.perf_counter() - start) * 1000})
+        else:
+            res['parallel'] = self.workers >= 2 and len(self._data) >= self.parallel_threshold
+        res['rows_scanned'] = len(rows)
+        for i, term in enumerate(query.terms):
+            if i in served:
+                continue
+            start = time.perf_counter()
+            out = list(filter(term['test'], rows))
+            res['stages'].append({'stage':'filter', 'key':term['key'], 'op':term['op'],
+                                  'rows_in':len(rows), 'rows_out':len(out),
+                                  'ms':(time.perf_counter() - start) * 1000})
+            rows = out
+        res['rows_returned'] = len(rows)
+        res['ms'] = (time.perf_counter() - begin) * 1000
+        return res
+
+    def find(self, match=None, projection=None, copy=True):
         """
         Return all rows matching query
+
+        projection: fields to return, as {'name':1,'ts':1} (plus the auto_index
+              field, unless it is set to 0) or {'blob':0} (all but these)
+        copy: False skips copying rows out of the db. The result's rows are
+              then the db's own, and must be treated as read-only
         """
+        projection = self.projector(projection)
         if match is None:
-            return db_result(self._data)
-        return db_result(self.do_query(self._data, match))
+            return db_result(self._data, self, copy, projection=projection)
+        return db_result(self._data, self, copy, self.compile(match), projection)
+
+    @_reads
+    def find_many(self, queries, limits=None, projection=None, copy=True):
+        """
+        find() for a batch of queries, sharing one pass over the rows: each
+        row is tested against every query still wanting rows. Queries an
+        index can serve are run from it instead. Returns a db_result per query
+
+        limits: row limit per query, None for no limit. A query drops out of
+                the pass once it has its rows, and the pass ends when all have
+        """
+        if limits is None:
+            limits = [None] * len(queries)
+        if len(limits) != len(queries):
+            raise Exception('db_object: find_many: need one limit per query')
+        projection = self.projector(projection)
+        start = time.perf_counter()
+        walked = 0  # rows the plans started from, for the slow query hook
+        found = [[] for q in queries]
+        active = []
+        for clauses, limit, rows in zip(queries, limits, found):
+            if limit is not None and limit <= 0:
+                continue
+            if not clauses:
+                rows.extend(self._data[:limit])
+                walked += len(rows)
+                continue
+            query = self.compile(clauses)
+            scanned = self.index_scan(query) if self._indexes else None
+            if scanned is not None:
+                rows.extend(itertools.islice(filter(scanned[1], scanned[0]), limit))
+                walked += len(scanned[0])
+            else:
+                active.append((query.test, rows, limit))
+        if active:
+            for row in self._data:
+                walked += 1
+                full = False
+                for test, rows, limit in active:
+                    if test(row):
+                        rows.append(row)
+                        full = full or len(rows) == limit
+                if full:
+                    active = [a for a in active if a[2] is None or len(a[1]) < a[2]]
+                    if not active:
+                        break
+        if self._slow is not None:
+            self.timed('find_many', queries, start, walked, sum(len(rows) for rows in found))
+        return [db_result(rows, self, copy, projection=projection) for rows in found]
+
+    def projector(self, projection):
+        """
+        (canonical key, function cutting a row down to projection), or None
+        when the projection keeps whole rows
+        """
+        if not projection:
+            return None
+        keep = [k for k, v in projection.items() if v]
+        drop = [k for k, v in projection.items() if not v]
+        if keep and [k for k in drop if k != self.auto_index]:
+            raise Exception('db_object: projection can not mix including and excluding fields')
+        if keep:
+            if self.auto_index and self.auto_index not in drop and self.auto_index not in keep:
+                keep.insert(0, self.auto_index)
+            fn = lambda row: {k: row[k] for k in keep if k in row}
+        else:
+            drop = set(drop)
+            fn = lambda row: {k: v for k, v in row.items() if k not in drop}
+        return canonical(projection), fn
 
+    @_writes
     def clear(self):
         """
         Erase the internal database
         """
         self._id = 0
         self._data = []
+        self._reindex()
+        self._rebased()
+        self._changed()
         return self
 
-    def remove(self, constraints):
+    @_writes
+    def remove(self, constraints, limit=None):
         """
-        Remove all rows from database that match the query
-        """
-        for matched in self.do_query(self._data, constraints):
-            self._data.remove(matched)
-        return self
+        Remove all rows from database that match the query, in one pass.
+        Returns the number of rows removed
 
+        limit: remove at most this many rows, the first ones in table order
+        """
+        start = time.perf_counter()
+        stats = {}
+        matched = self.iter_query(self._data, constraints, stats)
+        if limit is not None:
+            matched = itertools.islice(matched, limit)
+        rows = list(matched)
+        doomed = set(map(id, rows))
+        if self._sequenced():
+            views = list(self._views)
+            for row in rows:
+                for view in views:
+                    view.untrack(row)
+            self._untrack_many(rows)
+        if doomed:
+            self._changed()
+            if self._journal is not None:
+                self.log({'op':'r','at':[i for i, row in enumerate(self._data) if id(row) in doomed]})
+            self._data[:] = [row for row in self._data if id(row) not in doomed]
+        if self._slow is not None:
+            self.timed('remove', constraints, start, stats['scanned'], len(doomed))
+        return len(doomed)
+
+    @_writes
     def update(self, query, update, options=None):
         """
         Update all items matching query
@@ -419,18 +2186,86 @@ class db_object:
             self.insert(_set)
             return self
         did_change = False
+        at = None
+        cow = bool(self._snapshots)
         for row in matched:
+            changed = {}
             for key, val in _set.items():
                 if not row.get(key) or row[key] != val or val == 'now()':
+                    if cow and not changed:
+                        # snapshots share our rows: change a copy, leave them the original
+                        if at is None:
+                            at = {id(r): i for i, r in enumerate(self._data)}
+                        row = self._detach(row, at)
+                    index = self._indexes.get(key)
+                    if index is not None and key in row:
+                        index.discard(row, row[key], self._rowseq[id(row)])
                     if val == 'now()':
                         row[key] = datetime.strftime(datetime.now(),'%Y-%m-%dT%H:%M:%S.%f%z')
                     else:
                         row[key] = val
+                    if index is not None:
+                        index.add(row, self._rowseq[id(row)])
+                    changed[key] = row[key]
                     did_change = True
+            if changed:
+                self._changed()
+                for view in list(self._views):
+                    view.track(row)
+            if changed and self._journal is not None:
+                if at is None:
+                    at = {id(r): i for i, r in enumerate(self._data)}
+                self.log({'op':'u','at':at[id(row)],'set':changed})
             if not do_multi and did_change:
                 break # default is do only one row
         return self
 
+    def _detach(self, row, at):
+        """
+        Put a shallow copy of row in its place in _data and the indexes, and
+        return it. at maps id(row) to position, and is kept current
+        """
+        new = dict(row)
+        i = at[id(row)]
+        self._data[i] = new
+        at[id(new)] = i
+        if self._sequenced():
+            seq = self._rowseq[id(row)]
+            self._untrack(row)
+            self._rowseq[id(new)] = seq
+            for index in self._indexes.values():
+                index.add(new, seq)
+        return new
+
+    @_writes
+    def view(self, query=None, sort=None, callback=None):
+        """
+        A db_view: the rows matching query, kept current as the db changes
+
+        sort:     {key:direction, ...} as for db_result.sort(). Rows lacking
+                  the keys are left out
+        callback: callback(event, row) on each change, see db_view
+        """
+        if not self._sequenced():
+            self._renumber()
+        view = db_view(self, query, sort, callback)
+        with self._mutex:
+            self._views.add(view)
+        return view
+
+    @_reads
+    def snapshot(self):
+        """
+        A read-only db_object over the rows as they are now. Taking it only
+        copies the list of row references; later writes here leave it alone
+        (update() changes copies of rows while snapshots are alive)
+        """
+        snap = db_snapshot(auto_index=self.auto_index, data=list(self._data))
+        with self._mutex:
+            self._snapshots.add(snap)
+        return snap
+
+    @_reads
     def distinct(self, key, clause=None):
         """
         return only distinct set of key:value pairs possessing 'key'
@@ -438,34 +2273,641 @@ class db_object:
         """
         assert type(key) is type('')
 
+        qkey = self.compile(clause).key if clause is not None else ()
+        if qkey is None:
+            return db_result(self.distinct_rows(key, clause), self)
+        return db_result(list(self.cached(('distinct', key, qkey),
+                                          lambda: self.distinct_rows(key, clause))), self)
+
+    def distinct_rows(self, key, clause=None):
         if clause is not None:
             res = self.do_query(self._data, clause)
         else:
             res = self._data
 
-        # thin out to every row that has the key
-        haskey = []
+        # first row for each value: hashed, with a linear scan for the
+        # unhashable values (lists, dicts) only
+        distinct_set = []
+        seen = set()
+        unhashable = []
         for row in res:
-            if row.get(key) is not None:
-                haskey.append(row)
+            val = row.get(key)
+            if val is None:
+                continue
+            try:
+                if val in seen:
+                    continue
+                seen.add(val)
+            except TypeError:
+                if any(val == other for other in unhashable):
+                    continue
+                unhashable.append(val)
+            distinct_set.append(row)
 
-        distinct_set = []
-        for keyrow in haskey:
-            not_in = True
-            for distinct_row in distinct_set:
-                if distinct_row[key] == keyrow[key]:
-                    not_in = False
-                    break
-            if not_in:
-                distinct_set.append(keyrow)
+        return distinct_set
 
-        return db_result(distinct_set)
+    @_reads
+    def aggregate(self, pipeline):
+        """
+        Run rows through pipeline, a list of stages, returning a db_result.
+        Rows stream from one stage to the next; only $group and $sort hold
+        them all
+
+        {'$match': query}
+        {'$group': {'_id': '$key' or None, name: {'$count'|'$sum'|'$min'|'$max'|'$avg': '$key' or 1}}}
+        {'$sort': {key: direction}}
+        {'$limit': n}
+        {'$project': {key: 1} or {key: 0}}
+        """
+        rows = self._data
+        for i, stage in enumerate(pipeline):
+            if type(stage) is not type({}) or len(stage) != 1:
+                raise Exception('db_object: aggregate stage must be a dict with one key')
+            op, arg = list(stage.items())[0]
+            if op == '$match':
+                if i == 0:
+                    rows = self.iter_query(self._data, arg)
+                else:
+                    rows = filter(self.compile(arg).test, rows)
+            elif op == '$group':
+                rows = db_object.group_rows(rows, arg)
+            elif op == '$sort':
+                key, reverse = db_result.sort_key(list(arg.items()))
+                nxt = pipeline[i+1] if i + 1 < len(pipeline) else None
+                if type(nxt) is type({}) and list(nxt.keys()) == ['$limit']:
+                    # top-k on a heap, the $limit that follows is then a no-op
+                    pick = heapq.nlargest if reverse else heapq.nsmallest
+                    rows = pick(nxt['$limit'], rows, key=key)
+                else:
+                    rows = sorted(rows, key=key, reverse=reverse)
+            elif op == '$limit':
+                rows = itertools.islice(rows, arg)
+            elif op == '$project':
+                projection = self.projector(arg)
+                if projection is not None:
+                    rows = map(projection[1], rows)
+            else:
+                raise Exception('db_object: unknown aggregate stage {}'.format(op))
+        return db_result(list(rows), self)
 
-    def count(self):
-        return len(self._data)
+    ACCUMULATORS = ('$count', '$sum', '$min', '$max', '$avg')
 
+    @staticmethod
+    def group_rows(rows, spec):
+        """
+        One row per distinct spec['_id'], in order of first appearance, with
+        each other key of spec accumulated over the rows in the group
+        """
+        def getter(expr):
+            if type(expr) is type('') and expr.startswith('$'):
+                field = expr[1:]
+                return lambda row: row.get(field)
+            return lambda row: expr
+        group_by = getter(spec.get('_id'))
+        fields = []
+        for name, acc in spec.items():
+            if name == '_id':
+                continue
+            if type(acc) is not type({}) or len(acc) != 1 or \
+                    list(acc.keys())[0] not in db_object.ACCUMULATORS:
+                raise Exception('db_object: bad accumulator for {}'.format(name))
+            op, expr = list(acc.items())[0]
+            fields.append((name, op, getter(expr)))
+
+        groups = {}     # group value (or its canonical form) -> [row, count per field]
+        for row in rows:
+            val = group_by(row)
+            try:
+                gkey = (val,)
+                hash(gkey)
+            except TypeError:
+                gkey = canonical(val)
+            group = groups.get(gkey)
+            if group is None:
+                group = groups[gkey] = [{'_id': val}, {}]
+            out, counts = group
+            for name, op, get in fields:
+                if op == '$count':
+                    out[name] = out.get(name, 0) + 1
+                    continue
+                v = get(row)
+                if op == '$sum' or op == '$avg':
+                    if type(v) is type(True) or not isinstance(v, (int, float)):
+                        continue
+                    out[name] = out.get(name, 0) + v
+                    counts[name] = counts.get(name, 0) + 1
+                elif v is not None:
+                    if name not in out or (v < out[name] if op == '$min' else out[name] < v):
+                        out[name] = v
+
+        for out, counts in groups.values():
+            for name, op, get in fields:
+                if op == '$avg':
+                    out[name] = out[name] / counts[name] if counts.get(name) else None
+                elif name not in out:
+                    out[name] = 0 if op in ('$count', '$sum') else None
+            yield out
+
+    @_reads
+    def count(self, query=None):
+        """
+        Number of rows matching query (all rows if None), counted as they
+        stream past, without building a result
+        """
+        if not query:
+            return len(self._data)
+        start = time.perf_counter()
+        stats = {}
+        n = 0
+        for row in self.iter_query(self._data, query, stats):
+            n += 1
+        if self._slow is not None:
+            self.timed('count', query, start, stats['scanned'], n)
+        return n
+
+    @_reads
+    def exists(self, query=None):
+        """
+        True if any row matches query, stopping at the first one
+        """
+        if not query:
+            return len(self._data) > 0
+        return self.first(query, 'exists') is not None
+
+    def first(self, query, op):
+        """
+        The first row matching query, or None, reported to the slow query
+        hook as op
+        """
+        start = time.perf_counter()
+        stats = {}
+        row = next(self.iter_query(self._data, query, stats, parallel=False), None)
+        if self._slow is not None:
+            self.timed(op, query, start, stats['scanned'], 0 if row is None else 1)
+        return row
+
+    @_reads
+    def find_one(self, query=None, projection=None, copy=True):
+        """
+        The first row matching query, in table order, or None. Stops there
+
+        projection: as for find()
+        copy:       as for find(): False hands out the db's own row
+        """
+        projection = self.projector(projection)
+        if query:
+            row = self.first(query, 'find_one')
+        else:
+            row = self._data[0] if len(self._data) else None
+        if row is None:
+            return None
+        if projection is not None:
+            row = projection[1](row)
+        return db_result(row, copy=copy).data[0]
+
+    @_writes
     def recompute_indexes(self):
+        if self._snapshots:
+            self._data[:] = [dict(row) for row in self._data]
         self._id = 0 # reset doled out _id
         for row in sorted(self._data, key=lambda x:x['_id']): # make sure _id is sorted
             row[ self.auto_index ] = self.new_index() # set adjacent ids
+        self._reindex()
+        self._rebased()
+        self._changed()
+        return self
+
+
+class db_rows:
+    """
+    Read-only sequence of the rows of a jsonl file, decoded on demand.
+
+    The file is mmap'd, and the offset of every row is found once and kept
+    in path + '.offsets' for later opens. Decoded rows are held in an LRU of
+    cache_size rows; past that, a row is decoded again when next needed.
+    pin() keeps them all instead, so each row is the same dict every time.
+    """
+    MAGIC = 0x51524f5753    # header check for the offsets file
+
+    def __init__(self, path, cache_size=4096, codec=None):
+        self.path = path
+        self.cache_size = cache_size
+        self.codec = codec if codec is not None else db_object.codec
+        self._cache = OrderedDict()
+        self._pinned = None     # every row, while pinned
+        self._mutex = threading.Lock()
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._map = None # empty file
+        self._offsets = self.read_offsets()
+        if self._offsets is None:
+            self._offsets = self.find_offsets()
+            self.write_offsets()
+
+    def stamp(self):
+        st = os.stat(self.path)
+        return [db_rows.MAGIC, st.st_size, st.st_mtime_ns]
+
+    def read_offsets(self):
+        offsets = array('q')
+        try:
+            with open(self.path + '.offsets', 'rb') as f:
+                offsets.frombytes(f.read())
+        except IOError:
+            return None
+        if len(offsets) < 3 or list(offsets[:3]) != self.stamp():
+            return None
+        return offsets[3:]
+
+    def write_offsets(self):
+        try:
+            with open(self.path + '.offsets', 'wb') as f:
+                f.write(array('q', self.stamp()).tobytes())
+                f.write(self._offsets.tobytes())
+        except IOError:
+            pass # read-only location; rebuilt on next open
+
+    def find_offsets(self):
+        offsets = array('q')
+        if self._map is None:
+            return offsets
+        start = 0
+        size = len(self._map)
+        while start < size:
+            end = self._map.find(b'\n', start)
+            if end < 0:
+                end = size
+            if self._map[start:end].strip():
+                offsets.append(start)
+            start = end + 1
+        return offsets
+
+    def decode(self, i):
+        start = self._offsets[i]
+        end = self._map.find(b'\n', start)
+        if end < 0:
+            end = len(self._map)
+        return self.codec.loads(self._map[start:end])
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        if type(i) is type(slice(0)):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('db_rows: index out of range')
+        pinned = self._pinned
+        if pinned is not None:
+            return pinned[i]
+        with self._mutex:
+            row = self._cache.get(i)
+            if row is not None:
+                self._cache.move_to_end(i)
+                return row
+        row = self.decode(i)
+        with self._mutex:
+            self._cache[i] = row
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return row
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def pin(self, on=True):
+        """
+        Decode and keep every row while on, for indexes and views, which
+        know rows by identity; off goes back to the LRU
+        """
+        if not on:
+            self._pinned = None
+        elif self._pinned is None:
+            self._pinned = [self[i] for i in range(len(self))]
+        return self
+
+    def close(self):
+        self._cache.clear()
+        self._pinned = None
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class db_snapshot(db_object):
+    """
+    Consistent read-only view of a db_object, from db_object.snapshot().
+    Long reads can run on it without holding up writers to the original.
+    """
+    data = insert = insert_many = update = remove = clear = save = compact = recompute_indexes = _read_only
+
+
+class db_archive(db_object):
+    """
+    Read-only db_object over a jsonl file, for archives where a process only
+    touches a few rows. load() maps the file instead of parsing it, so start
+    up time and memory stay flat as the file grows; rows are decoded when a
+    query reaches them (see db_rows). Indexing an archive, or a view on it,
+    decodes and keeps every row until the last index is dropped.
+
+    USAGE:
+    db = db_archive(path='/path/to/archive.jsonl').load()
+    res = db.find({'key':'value'})
+    """
+    def __init__(self, path=None, auto_index='_id', cache_size=4096):
+        db_object.__init__(self, path=path, auto_index=auto_index, fmt='jsonl')
+        self.cache_size = cache_size
+
+    @_writes
+    def load(self, path=False):
+        self.setPath(path)
+        if not self._path:
+            raise Exception('** error: Path not set')
+        self.close()
+        self._data = db_rows(self._path, self.cache_size, self.codec)
+        self._reindex()
+        self._changed()
+        return self
+
+    def _renumber(self):
+        if isinstance(self._data, db_rows):
+            self._data.pin()
+        db_object._renumber(self)
+
+    @_writes
+    def drop_index(self, field):
+        db_object.drop_index(self, field)
+        if not self._sequenced() and isinstance(self._data, db_rows):
+            self._data.pin(False)
+        return self
+
+    def close(self):
+        if isinstance(self._data, db_rows):
+            self._data.close()
+            self._data = []
+        return self
+
+    data = insert = insert_many = update = remove = clear = save = compact = recompute_indexes = _read_only
+
+
+class database:
+    """
+    A directory of collections, each a db_object over its own file, loaded
+    the first time it is asked for. Past memory_budget (bytes of collection
+    files), the least recently used collections are saved if changed and let
+    go; one still held elsewhere is picked back up rather than read again.
+    save() writes only the collections changed since they were last loaded
+    or saved.
+    """
+    EXTENSIONS = {'json':'.json', 'jsonl':'.jsonl', 'snap':'.snap'}
+
+    def __init__(self, path, fmt='json', memory_budget=None, **options):
+        """
+        path:    directory with one file per collection, made if missing
+        fmt:     format for new collections: 'json', 'jsonl' or 'snap'
+        memory_budget: bytes of collection files to keep loaded, None for no limit
+        options: passed on to every db_object, such as auto_index or journal
+        """
+        if fmt not in database.EXTENSIONS:
+            raise Exception('database: unknown format {}'.format(fmt))
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.fmt = fmt
+        self.memory_budget = memory_budget
+        self.options = options
+        self._loaded = OrderedDict()    # name -> [db, file size], least recently used first
+        self._released = weakref.WeakValueDictionary()  # let go of, but still held elsewhere
+        self._gens = {}     # name -> db._gen as of its last load or save
+        self._mutex = threading.RLock()
+
+    def file_for(self, name):
+        """
+        The collection's file: an existing one in any format, else a new one in fmt
+        """
+        if type(name) is not type('') or not name or name.startswith('.') or \
+                os.sep in name or (os.altsep and os.altsep in name):
+            raise Exception('database: bad collection name {!r}'.format(name))
+        for ext in database.EXTENSIONS.values():
+            path = os.path.join(self.path, name + ext)
+            if os.path.exists(path):
+                return path
+        return os.path.join(self.path, name + database.EXTENSIONS[self.fmt])
+
+    def names(self):
+        """
+        Every collection, on disk or in memory
+        """
+        found = set(self._loaded)
+        for f in os.listdir(self.path):
+            name, ext = os.path.splitext(f)
+            if ext in database.EXTENSIONS.values():
+                found.add(name)
+        return sorted(found)
+
+    def __contains__(self, name):
+        return name in self.names()
+
+    def __getitem__(self, name):
+        return self.collection(name)
+
+    def collection(self, name):
+        """
+        The db_object of collection name, loading it (or creating its file) if needed
+        """
+        with self._mutex:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                self._loaded.move_to_end(name)
+                return entry[0]
+            path = self.file_for(name)
+            db = self._released.pop(name, None)
+            if db is None:
+                db = db_object(path=path, **self.options).load()
+                self._gens[name] = db._gen
+            self._loaded[name] = [db, database.size_of(path)]
+            self.trim(keep=name)
+            return db
+
+    @staticmethod
+    def size_of(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def loaded(self):
+        """
+        Names of the collections in memory, least recently used first
+        """
+        return list(self._loaded)
+
+    def trim(self, keep=None):
+        """
+        Let go of least recently used collections until within memory_budget
+        """
+        if self.memory_budget is None:
+            return self
+        with self._mutex:
+            total = sum(size for db, size in self._loaded.values())
+            for name in list(self._loaded):
+                if total <= self.memory_budget:
+                    break
+                if name != keep:
+                    total -= self._loaded[name][1]
+                    self.unload(name)
+        return self
+
+    def unload(self, name):
+        """
+        Save collection name if changed, and drop it from memory
+        """
+        with self._mutex:
+            entry = self._loaded.pop(name, None)
+            if entry is not None:
+                self.flush(name, entry[0])
+                self._released[name] = entry[0]
+        return self
+
+    def flush(self, name, db):
+        if db._gen != self._gens.get(name):
+            db.save()
+            self._gens[name] = db._gen
+            return True
+        return False
+
+    def save(self):
+        """
+        Write every collection changed since it was loaded or last saved
+        """
+        with self._mutex:
+            for name, entry in self._loaded.items():
+                if self.flush(name, entry[0]):
+                    entry[1] = database.size_of(entry[0].path())
+            for name, db in list(self._released.items()):
+                self.flush(name, db)
+        return self
+
+    def drop(self, name):
+        """
+        Delete collection name, from memory and disk
+        """
+        with self._mutex:
+            path = self.file_for(name)
+            self._loaded.pop(name, None)
+            self._released.pop(name, None)
+            self._gens.pop(name, None)
+            for f in (path, path + '.journal', path + '.offsets'):
+                if os.path.exists(f):
+                    os.remove(f)
         return self
+
+
+class async_db_object:
+    """
+    asyncio front end to a db_object. File I/O and scans run in an executor
+    (the loop's default thread pool unless one is given), so the event loop
+    never blocks on them; db_object's locking keeps the threads apart.
+
+    USAGE:
+    adb = async_db_object(db_object(path='/path/to/file.json'))
+    await adb.aload()
+    async for row in adb.afind({'key':'value'}):
+        ...
+    await adb.ainsert({'key':'value'})
+    await adb.asave()
+    """
+    def __init__(self, db=None, executor=None, chunk_rows=1000):
+        """
+        chunk_rows: rows copied out per executor call while streaming results
+        """
+        self.db = db if db is not None else db_object()
+        self.chunk_rows = chunk_rows
+        self._executor = executor
+        self._saving = None     # the save being written
+        self._queued = None     # the save that follows it, shared by all who ask meanwhile
+
+    def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def aload(self, path=False):
+        await self.run(self.db.load, path)
+        return self
+
+    async def asave(self):
+        """
+        Save in the executor. Calls made while a save is being written share
+        one follow-up save, so a burst of them costs at most two writes
+        """
+        if self._queued is None:
+            self._queued = asyncio.ensure_future(self._save(self._saving))
+        await asyncio.shield(self._queued)
+        return self
+
+    async def _save(self, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        me = asyncio.current_task()
+        self._saving = me
+        if self._queued is me:
+            self._queued = None
+        try:
+            await self.run(self.db.save)
+        finally:
+            if self._saving is me:
+                self._saving = None
+
+    async def afind(self, match=None, projection=None, sort=None, skip=0, limit=None):
+        """
+        Async iterator over the rows matching query, as db_object.find() with
+        sort/skip/limit applied. See stream()
+        """
+        res = self.db.find(match, projection)
+        if sort:
+            res.sort(sort)
+        if skip:
+            res.skip(skip)
+        if limit is not None:
+            res.limit(limit)
+        async for row in self.stream(res):
+            yield row
+
+    async def stream(self, res):
+        """
+        Async iterator over the rows of a db_result. The plan runs in the
+        executor, then rows are copied out chunk_rows at a time
+        """
+        rows = await self.run(res.rows)
+        for start in range(0, len(rows), self.chunk_rows):
+            chunk = rows[start:start + self.chunk_rows]
+            if res._copy:
+                chunk = await self.run(self.copy_rows, res, chunk)
+            for row in chunk:
+                yield row
+
+    @staticmethod
+    def copy_rows(res, rows):
+        """
+        Deep copy rows of res under its db's read lock, as writers change rows in place
+        """
+        with res.reading():
+            return copy.deepcopy(rows)
+
+    async def ainsert(self, row_or_ary):
+        await self.run(self.db.insert, row_or_ary)
+        return self
+
+    async def aupdate(self, query, update, options=None):
+        await self.run(self.db.update, query, update, options)
+        return self
+
+    async def aremove(self, constraints, limit=None):
+        return await self.run(self.db.remove, constraints, limit)
+
+    async def adistinct(self, key, clause=None):
+        return await self.run(self.db.distinct, key, clause)
@@ -0,0 +1,140 @@
+"""
+bench.py
+
+Times every db_object operation on seeded synthetic data, and reports the
+results as JSON. Not part of the unit tests: run it by hand.
+
+USAGE:
+python tests/bench/bench.py                         # 1k to 1M rows
+python tests/bench/bench.py --sizes 1000,10000 --out run.json
+python tests/bench/bench.py --index                 # same, on indexed fields
+python tests/bench/bench.py --compare baseline.json # flag slowdowns vs a saved run
+"""
+
+import re
+import os, sys
+import json
+import time
+import random
+import argparse
+import shutil
+import tempfile
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Queryable import db_object
+
+p = lambda s: print(str(s))
+
+def make_rows(n, seed):
+    rnd = random.Random(seed)
+    users = ['user{}'.format(i) for i in range(max(n // 100, 1))]
+    return [{'user':rnd.choice(users),
+             'n':rnd.randint(0, 1000),
+             'score':rnd.random(),
+             'ord':'ORD-{}-{:06d}'.format(rnd.choice([2024, 2025, 2026]), i),
+             'flag':rnd.random() < 0.1}
+            for i in range(n)]
+
+def cases(n, seed, path, index):
+    """
+    (name, setup, fn) for each operation; setup() returns the db fn runs on
+    """
+    rows = make_rows(n, seed)
+    def fresh():
+        db = db_object().data([dict(r) for r in rows])
+        if index:
+            db.create_index('user').create_index('flag')
+            for field in ('n', 'score', 'ord'):
+                db.create_index(field, ordered=True)
+        return db
+    fresh().save(path=path)
+    snap = os.path.splitext(path)[0] + '.snap'
+    fresh().save(path=snap)
+    return [
+        ('insert_one',      lambda: db_object(),    lambda db: [db.insert(dict(r)) for r in rows]),
+        ('insert_bulk',     lambda: db_object(),    lambda db: db.insert([dict(r) for r in rows])),
+        ('insert_many',     lambda: db_object(),    lambda db: db.insert_many([dict(r) for r in rows], validate=False, stamp=False)),
+        ('find_NORMAL',     fresh,  lambda db: db.find({'user':'user1'}).data),
+        ('find_CONDITIONAL',fresh,  lambda db: db.find({'n':{'$gte':500,'$lt':510}}).data),
+        ('find_in',         fresh,  lambda db: db.find({'n':{'$in':[1,2,3]}}).data),
+        ('find_OR',         fresh,  lambda db: db.find({'$or':[{'n':1},{'user':'user2'}]}).data),
+        ('find_regex',      fresh,  lambda db: db.find({'ord':re.compile('^ORD-2026-00')}).data),
+        ('find_all',        fresh,  lambda db: db.find().data),
+        ('find_many',       fresh,  lambda db: [r.data for r in db.find_many([{'user':'user%d' % i} for i in range(40)])]),
+        ('count_query',     fresh,  lambda db: db.count({'user':'user1'})),
+        ('exists',          fresh,  lambda db: db.exists({'user':'user1'})),
+        ('find_one',        fresh,  lambda db: db.find_one({'user':'user1'})),
+        ('sort',            fresh,  lambda db: db.find().sort({'score':-1}).data),
+        ('sort_limit',      fresh,  lambda db: db.find().sort({'score':-1}).limit(10).data),
+        ('update_one',      fresh,  lambda db: db.update({'user':'user1'},{'$set':{'n':-1}})),
+        ('update_multi',    fresh,  lambda db: db.update({'flag':True},{'$set':{'n':-1}},{'multi':True})),
+        ('remove',          fresh,  lambda db: db.remove({'flag':True})),
+        ('distinct',        fresh,  lambda db: db.distinct('user').data),
+        ('load',            lambda: db_object(path=path), lambda db: db.load()),
+        ('save',            fresh,  lambda db: db.save(path=path + '.out')),
+        ('load_snap',       lambda: db_object(path=snap), lambda db: db.load()),
+        ('save_snap',       fresh,  lambda db: db.save(path=snap + '.out.snap')),
+    ]
+
+def run(sizes, seed, repeat, index=False):
+    results = {}
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'bench.json')
+    for n in sizes:
+        for name, setup, fn in cases(n, seed, path, index):
+            def once():
+                db = setup()
+                start = time.perf_counter()
+                fn(db)
+                return time.perf_counter() - start
+            best = min(once() for i in range(repeat))
+            results['{}/{}'.format(name, n)] = best
+            p('{:>20} {:>9} rows {:10.3f} ms'.format(name, n, best * 1000))
+    shutil.rmtree(tmp)
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Print each timing against the baseline; returns the names that got slower
+    """
+    slower = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name] / baseline[name] if baseline[name] else 1.0
+        mark = ''
+        if ratio > 1 + tolerance:
+            slower.append(name)
+            mark = '  SLOWER'
+        p('{:>30} {:6.2f}x{}'.format(name, ratio, mark))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Queryable.py benchmarks')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma separated row counts, eg 1000,1000000')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; best is kept')
+    parser.add_argument('--index', action='store_true', help='index the queried fields first')
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--compare', help='baseline results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown vs baseline before flagging, 0.2 = 20%%')
+    args = parser.parse_args(argv)
+
+    sizes = [int(x) for x in args.sizes.split(',')]
+    results = run(sizes, args.seed, args.repeat, args.index)
+    report = {'sizes':sizes, 'seed':args.seed, 'repeat':args.repeat, 'index':args.index,
+              'results':results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline['results'], args.tolerance):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,10 +3,16 @@ import re
 import os, sys
 import unittest
 import json
+import copy
+import threading
+import shutil
+import asyncio
+import weakref
+import gc
 
 sys.path.append(os.path.realpath('.'))
 sys.path.append(os.path.realpath('..'))
-from Queryable import db_object
+from Queryable import db_object, db_archive, async_db_object, db_codec, database
 
 p = lambda s: print(str(s))
 
@@ -93,11 +99,31 @@ class QueryableTests(unittest.TestCase):
 
     def test_remove(self):
         db = db_object(auto_index='').insert([{'a':3},{'a':5},{'b':2},{'a':1}])
-        res = db.remove({'a':{'$exists':True}})._data
+        db.remove({'a':{'$exists':True}})
+        res = db._data
         self.assertEqual(res, [{'b':2}] )
         db = db_object(auto_index='').insert([{'a':3},{'a':5},{'b':2},{'a':1}])
-        res = db.remove({'a':{'$exists':False}})._data
+        db.remove({'a':{'$exists':False}})
+        res = db._data
         self.assertEqual(res, [{'a': 3}, {'a': 5}, {'a': 1}] )
+        db = db_object(auto_index='').data([{'a':1},{'a':2},{'a':1},{'a':1}])
+        self.assertEqual(db.remove({'a':1}, limit=2), 2)
+        self.assertEqual(db._data, [{'a':2},{'a':1}])
+        self.assertEqual(db.create_index('a').remove({'a':{'$in':[1,2]}}), 2)
+        self.assertEqual(db.remove({'a':1}), 0)
+        self.assertEqual(db._data, [])
+        # a bulk remove filters each ordered run once; a small one bisects
+        rows = [{'a':i % 10,'s':str(i)} for i in range(500)] + [{'a':'x'},{'a':None}]
+        db = db_object().insert(copy.deepcopy(rows)).create_index('a', ordered=True).create_index('s', ordered=True)
+        self.assertEqual(db.remove({'a':{'$lt':5}}), 250)
+        self.assertEqual(db.remove({'s':'499'}), 1)
+        plain = db_object().insert(copy.deepcopy(rows))
+        plain.remove({'a':{'$lt':5}})
+        plain.remove({'s':'499'})
+        for q in [{'a':{'$gte':3}}, {'a':7}, {'s':{'$gt':'40'}}, {'a':'x'}, {'a':None}]:
+            self.assertEqual(db.find(q).data, plain.find(q).data)
+        self.assertEqual(len(db._indexes['a'].nums[1]), 249)
+        self.assertEqual(len(db._indexes['s'].strs[1]), 249)
         p('REMOVE')
 
     def test_or(self):
@@ -207,6 +233,92 @@ class QueryableTests(unittest.TestCase):
         self.assertEqual(db._data, VIRGIN)
         self.assertEqual(res.data, [{'a':666},{'a':0}])
 
+    def test_index(self):
+        db = db_object().insert([{'u':'x','n':1},{'u':'y','n':2},{'u':'x','n':3},{'n':4}])
+        db.create_index('u')
+        self.assertEqual(db.find({'u':'x'}).data,
+            [{'u':'x','n':1,'_id':1},{'u':'x','n':3,'_id':3}])
+        self.assertEqual(db.find({'u':{'$in':['y','x']},'n':{'$gt':1}}).data,
+            [{'u':'y','n':2,'_id':2},{'u':'x','n':3,'_id':3}])
+        db.insert({'u':'x','n':5})
+        db.update({'n':1},{'$set':{'u':'z'}})
+        self.assertEqual([r['n'] for r in db.find({'u':'x'}).data], [3,5])
+        self.assertEqual([r['n'] for r in db.find({'u':'z'}).data], [1])
+        db.remove({'u':'x'})
+        self.assertEqual(db.find({'u':'x'}).data, [])
+        self.assertEqual(db.count(), 3)
+        db.data([{'u':'q'}])
+        self.assertEqual(db.find({'u':'q'}).count(), 1)
+        db.drop_index('u')
+        self.assertEqual(db.find({'u':'q'}).count(), 1)
+
+    def test_sorted_index(self):
+        rows = [{'x':v} for v in [5, 'b', 2.5, None, 'a', 1, True, 5, 9, 'c']]
+        plain = db_object().insert(copy.deepcopy(rows))
+        db = db_object().insert(copy.deepcopy(rows)).create_index('x', ordered=True)
+        for q in [{'$gt':2}, {'$gte':5}, {'$lt':'b'}, {'$lte':5.0}, {'$gt':1,'$lt':9},
+                  {'$gte':'a','$lt':'c'}, {'$gt':1,'$ne':5}, {'$gt':1,'$lt':'z'}]:
+            self.assertEqual(db.find({'x':q}).data, plain.find({'x':q}).data)
+        self.assertEqual(db.find({'x':{'$gt':1,'$lt':9}}).data,
+            [{'x':5,'_id':1},{'x':2.5,'_id':3},{'x':5,'_id':8}])
+        db.update({'_id':9},{'$set':{'x':0}})
+        db.remove({'x':2.5})
+        self.assertEqual([r['_id'] for r in db.find({'x':{'$lt':5}}).data], [6,9])
+        res = db.find({'x':{'$gte':0}}).sort({'x':-1})
+        self.assertEqual([r['_id'] for r in res.data], [1,8,6,9])
+        res = db.find({'x':{'$gte':0}}).sort({'x':1})
+        self.assertEqual([r['_id'] for r in res.data], [9,6,1,8])
+
+    def test_sorted_index_nan(self):
+        rows = [{'x':v} for v in [3, float('nan'), 1, 5, 2, float('nan'), 4]]
+        plain = db_object().insert(copy.deepcopy(rows))
+        db = db_object().insert(copy.deepcopy(rows)).create_index('x', ordered=True)
+        ids = lambda res: [r['_id'] for r in res.data]
+        for q in [{'$gt':2}, {'$gte':1,'$lte':5}, {'$lt':4}, {'$lte':3.5}]:
+            self.assertEqual(ids(db.find({'x':q})), ids(plain.find({'x':q})))
+        self.assertEqual(ids(db.find({'x':{'$gt':2}})), [1,4,7])
+        db.remove({'_id':2})
+        db.update({'_id':6}, {'$set':{'x':0}})
+        self.assertEqual(ids(db.find({'x':{'$lt':2}})), [3,6])
+        self.assertEqual(db._indexes['x'].others, {})
+
+    def test_compile(self):
+        db = db_object(auto_index='').insert([{'a':1,'b':'x'},{'a':2,'b':'y'},{'a':3}])
+        q = {'b':re.compile('^[xy]'),'a':{'$gte':2}}
+        compiled = db.compile(q)
+        self.assertIs(db.compile({'b':re.compile('^[xy]'),'a':{'$gte':2}}), compiled)
+        self.assertIsNot(db.compile({'a':{'$gte':2.0}}), db.compile({'a':{'$gte':2}}))
+        self.assertEqual([t['op'] for t in compiled.terms], ['$gte', 'REGEX'])
+        self.assertEqual(db.find(q).data, [{'a':2,'b':'y'}])
+        self.assertEqual(db.find({'$or':[{'a':{'$gt':1,'$lt':3}},{'b':'x'}]}).data,
+            [{'a':1,'b':'x'},{'a':2,'b':'y'}])
+        self.assertEqual(db.distinct('a', {'a':{'$ne':2}}).data, [{'a':1,'b':'x'},{'a':3}])
+
+    def test_result_copy(self):
+        db = db_object(auto_index='').insert([{'a':1,'b':{'c':1}},{'a':2,'b':{'c':2}}])
+        res = db.find({'a':{'$gt':0}})
+        res.data[0]['b']['c'] = 666
+        self.assertEqual(db._data[0], {'a':1,'b':{'c':1}})
+        ro = db.find({'a':2}, copy=False)
+        self.assertIs(ro.data[0], db._data[1])
+        mine = ro.copy()
+        mine.data[0]['a'] = 3
+        self.assertEqual(db._data[1]['a'], 2)
+        self.assertEqual(db.find().sort({'a':-1}).limit(1).toString(compact=True), '[{"a":2,"b":{"c":2}}]')
+
+    def test_cursor(self):
+        db = db_object(auto_index='').insert([{'a':1,'b':2},{'a':2,'b':1},{'a':1,'b':3},{'a':2,'b':5}])
+        res = db.find({'b':{'$gt':1}}).sort({'a':1,'b':-1}).skip(1).limit(2)
+        db.insert({'a':0,'b':9}) # cursors run when read
+        self.assertEqual(res.data, [{'a':1,'b':3},{'a':1,'b':2}])
+        self.assertEqual(db.find().limit(None).skip(None).count(), 5)
+        self.assertEqual(db.find().limit(2).limit(None).data, [{'a':1,'b':2},{'a':2,'b':1}])
+        self.assertEqual([r['b'] for r in db.find().sort({'b':-1}).limit(2)], [9,5])
+        self.assertEqual(db.find().limit(3).skip(1).count(), 2)
+        db.create_index('b', ordered=True)
+        self.assertEqual(db.find({'a':{'$gt':0}}).sort({'b':-1}).limit(2).data,
+            [{'a':2,'b':5},{'a':1,'b':3}])
+
     def test_save_load(self):
         orig_data = [{'x':'fred'},{'x':'dead'},{'x':256},{'x':'leded'}]
         filename = 'test_generated_eraseme'
@@ -217,5 +329,422 @@ class QueryableTests(unittest.TestCase):
         db = db_object().load(path=filename)
         self.assertEqual(db._data, orig_data)
 
+    def test_journal(self):
+        filename = 'test_generated_journal_eraseme'
+        db = db_object(path=filename, journal=True).insert([{'x':1},{'x':2},{'x':3}]).save()
+        snapshot = open(filename).read()
+        db.insert({'x':4,'t':'now()'})
+        db.update({'x':2},{'$set':{'y':'two'}})
+        db.remove({'x':1})
+        db.save()
+        self.assertEqual(open(filename).read(), snapshot)
+        self.assertTrue(os.path.exists(filename + '.journal'))
+        again = db_object(path=filename, journal=True).load()
+        self.assertEqual(again._data, db._data)
+        again.insert({'x':5}).save()
+        self.assertEqual(db_object(journal=True).load(path=filename).count(), 4)
+        again.compact()
+        self.assertFalse(os.path.exists(filename + '.journal'))
+        self.assertEqual(db_object().load(path=filename)._data, again._data)
+        os.remove(filename)
+
+    def test_jsonl(self):
+        filename = 'test_generated_eraseme.jsonl'
+        orig_data = [{'x':'fred','_id':7},{'x':[1,2]},{'x':{'y':'\\n'}}]
+        db_object(path=filename).data(copy.deepcopy(orig_data)).save()
+        with open(filename) as f:
+            self.assertEqual([json.loads(line) for line in f], db_object().data(copy.deepcopy(orig_data))._data)
+        db = db_object().load(path=filename)
+        self.assertEqual(db.insert({'x':0})._data[-1], {'x':0,'_id':8})
+        db.save().setPath('test_generated_eraseme').save()
+        self.assertEqual(db_object().load(path='test_generated_eraseme')._data, db._data)
+        self.assertEqual(db_object(fmt='jsonl').load(path=filename).count(), 4)
+        db = db_object(path=filename)
+        lines = []
+        iter_file = db.iter_file
+        db.iter_file = lambda: (lines.append(row) or row for row in iter_file())
+        self.assertEqual(db.load().count(), 4)
+        self.assertEqual(len(lines), 4)
+        os.remove(filename)
+
+    def test_archive(self):
+        filename = 'test_generated_eraseme.jsonl'
+        db_object(path=filename).insert([{'x':i,'s':str(i)} for i in range(50)]).save()
+        db = db_archive(path=filename, cache_size=8).load()
+        self.assertEqual(db.count(), 50)
+        self.assertEqual(db.find({'x':{'$gte':48}}).data, [{'x':48,'s':'48','_id':49},{'x':49,'s':'49','_id':50}])
+        self.assertEqual(db.find().sort({'x':-1}).limit(1).data[0]['x'], 49)
+        self.assertTrue(len(db._data._cache) <= 8)
+        self.assertTrue(os.path.exists(filename + '.offsets'))
+        again = db_archive().load(path=filename).create_index('s')
+        self.assertEqual(again.find({'s':'7'}).count(), 1)
+        self.assertRaises(Exception, again.insert, {'x':1})
+        # indexed rows outnumber the cache: they are kept, the same dicts each pass
+        db.create_index('x', ordered=True)
+        self.assertEqual(db.find({'x':{'$lt':2}}).data, [{'x':0,'s':'0','_id':1},{'x':1,'s':'1','_id':2}])
+        view = db.view({'x':{'$gte':46}}, sort={'x':-1})
+        self.assertEqual([row['x'] for row in view.rows()], [49,48,47,46])
+        db.drop_index('x')
+        self.assertIsNotNone(db._data._pinned) # the view still needs them
+        view.close()
+        db.close()
+        again.close()
+        os.remove(filename)
+        os.remove(filename + '.offsets')
+
+    def test_result_cache(self):
+        db = db_object(result_cache=2).insert([{'a':1},{'a':2},{'a':1}])
+        self.assertEqual(db.find({'a':1}).count(), 2)
+        self.assertEqual(db.find({'a':1}).data, [{'a':1,'_id':1},{'a':1,'_id':3}])
+        self.assertEqual(db.distinct('a').count(), 2)
+        self.assertEqual(db.distinct('a').count(), 2)
+        self.assertEqual(db.cache_info(), {'hits':2,'misses':2,'size':2,'maxsize':2})
+        db.find({'a':1}).data[0]['a'] = 5 # copies are still handed out
+        db.update({'_id':2},{'$set':{'a':1}})
+        self.assertEqual(db.find({'a':1}).count(), 3)
+        self.assertEqual(db.find({'a':1}).sort({'_id':-1}).limit(1).data, [{'a':1,'_id':3}])
+        db.remove({'_id':3})
+        self.assertEqual(db.find({'a':1}).count(), 2)
+        self.assertEqual(db.cache_info()['hits'], 3)
+        db.insert({'a':4,'b':2})
+        db.find({'a':4}, {'b':1}, copy=False).data[0]['b'] = 99
+        self.assertEqual(db.find({'a':4}, {'b':1}).data, [{'b':2,'_id':4}])
+        self.assertEqual(db.find({'a':4}, {'b':1}, copy=False).data, [{'b':2,'_id':4}])
+
+    def test_projection(self):
+        db = db_object().insert([{'a':1,'b':{'big':[1,2]},'c':'x'},{'a':2,'b':{'big':[3]},'c':'y'}])
+        self.assertEqual(db.find({'a':1}, {'c':1}).data, [{'_id':1,'c':'x'}])
+        self.assertEqual(db.find(None, {'c':1,'_id':0}).sort({'a':-1}).data, [{'c':'y'},{'c':'x'}])
+        self.assertEqual(db.find({'a':2}, {'b':0}).toString(compact=True), '[{"a":2,"c":"y","_id":2}]')
+        res = db.find({'a':1}, {'b':1}, copy=False)
+        self.assertIs(res.data[0]['b'], db._data[0]['b'])
+        self.assertRaises(Exception, db.find, {}, {'a':1,'b':0})
+
+    def test_parallel(self):
+        rows = [{'x':i % 7,'s':'r%d' % i} for i in range(2000)]
+        db = db_object(workers=2, parallel_threshold=1000).insert(copy.deepcopy(rows))
+        serial = db_object().insert(copy.deepcopy(rows))
+        q = {'x':{'$in':[1,3]},'s':re.compile('r1')}
+        self.assertEqual(db.find(q).data, serial.find(q).data)
+        self.assertEqual(db.remove({'x':3}), serial.remove({'x':3}))
+        self.assertEqual(db.find({'x':{'$gte':2}}).count(), serial.find({'x':{'$gte':2}}).count())
+        # a db let go of is freed, and its workers shut down
+        pool, ref = db._pool, weakref.ref(db)
+        self.assertIsNotNone(pool)
+        del db
+        gc.collect()
+        self.assertIsNone(ref())
+        self.assertRaises(RuntimeError, pool.submit, int)
+
+    def test_threads(self):
+        db = db_object().insert([{'x':i} for i in range(200)])
+        errors = []
+        def writer():
+            for i in range(300):
+                db.insert({'x':i})
+                db.remove({'x':i}, limit=1)
+                db.update({'x':{'$gte':0}}, {'$set':{'k%d' % (i % 50):i}}, {'multi':True})
+        def reader():
+            try:
+                for i in range(100):
+                    self.assertIn(db.find({'x':{'$gte':0}}).count(), (200, 201))
+                    self.assertIn(len(db.find({'x':{'$gte':0}}).data), (200, 201))
+                    self.assertIn(len(db.distinct('x').data), (200, 201))
+                    self.assertIn(len(db.aggregate([{'$match':{'x':{'$gte':0}}}]).data), (200, 201))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for i in range(3)]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(db.count(), 200)
+
+    def test_snapshot(self):
+        db = db_object().insert([{'x':1},{'x':2}]).create_index('x')
+        snap = db.snapshot()
+        db.update({'x':1},{'$set':{'x':5}})
+        db.insert({'x':3})
+        db.remove({'x':2})
+        self.assertEqual(snap.find().data, [{'x':1,'_id':1},{'x':2,'_id':2}])
+        self.assertEqual(db.find({'x':5}).data, [{'x':5,'_id':1}])
+        self.assertEqual(db.find({'x':1}).data, [])
+        self.assertRaises(Exception, snap.insert, {'x':0})
+
+    def test_async(self):
+        filename = 'test_generated_eraseme'
+        saves = []
+        async def main():
+            adb = async_db_object(db_object(path=filename), chunk_rows=2)
+            await adb.ainsert([{'x':i} for i in range(5)])
+            save = adb.db.save
+            adb.db.save = lambda *a: saves.append(1) or save(*a)
+            await asyncio.gather(*[adb.asave() for i in range(5)])
+            adb = await async_db_object(db_object(path=filename)).aload()
+            return [row['x'] async for row in adb.afind({'x':{'$gt':0}}, sort={'x':-1}, limit=3)]
+        self.assertEqual(asyncio.run(main()), [4,3,2])
+        self.assertTrue(len(saves) <= 2)
+        os.remove(filename)
+
+    def test_async_writes(self):
+        async def main():
+            adb = async_db_object(db_object().insert([{'x':i} for i in range(300)]), chunk_rows=50)
+            async def reader():
+                for i in range(10):
+                    rows = [row async for row in adb.afind({'x':{'$gte':0}})]
+                    self.assertEqual(len(rows), 300)
+            async def writer():
+                for i in range(100):
+                    await adb.aupdate({'x':{'$gte':0}}, {'$set':{'k%d' % i:i}}, {'multi':True})
+            await asyncio.gather(writer(), *[reader() for i in range(3)])
+            return adb.db.count({'k99':99})
+        self.assertEqual(asyncio.run(main()), 300)
+
+    def test_explain(self):
+        db = db_object().insert([{'u':i % 4,'n':i} for i in range(40)]).create_index('u')
+        plan = db.explain({'n':{'$gte':20},'u':1})
+        self.assertEqual(plan['clauses'], [{'key':'n','type':'CONDITIONAL'},{'key':'u','type':'NORMAL'}])
+        self.assertEqual(plan['index'], 'u')
+        self.assertEqual([(st['stage'], st['rows_in'], st['rows_out']) for st in plan['stages']],
+            [('index', 40, 10), ('filter', 10, 5)])
+        self.assertEqual((plan['rows_scanned'], plan['rows_returned']), (10, 5))
+        slow = []
+        db.on_slow_query(slow.append, ms=0)
+        db.find({'n':{'$lt':3}}).data
+        db.remove({'u':2})
+        self.assertEqual([(q['op'], q['rows_scanned'], q['rows_returned']) for q in slow],
+            [('find', 40, 3), ('remove', 10, 10)])
+        db.on_slow_query(None)
+        db.find().data
+        self.assertEqual(len(slow), 2)
+        db.on_slow_query(slow.append, ms=0)
+        db.count({'u':1})
+        db.exists({'n':{'$gt':35}})
+        db.find_one({'n':-1})
+        db.find_many([{'n':{'$lt':3}}, {'u':3}], limits=[1, None])
+        self.assertEqual([(q['op'], q['rows_scanned'], q['rows_returned']) for q in slow[2:]],
+            [('count', 10, 10), ('exists', 30, 1), ('find_one', 30, 0), ('find_many', 11, 11)])
+
+    def test_aggregate(self):
+        db = db_object().insert([{'u':'a','v':1},{'u':'b','v':5},{'u':'a','v':3},{'u':'c'},{'u':'b','v':2}])
+        self.assertEqual([r['u'] for r in db.distinct('u')], ['a','b','c'])
+        db.insert([{'u':[1,2]},{'u':[1,2]}])
+        self.assertEqual(db.distinct('u').count(), 4)
+        res = db.aggregate([
+            {'$match':{'v':{'$gt':0}}},
+            {'$group':{'_id':'$u','n':{'$count':{}},'total':{'$sum':'$v'},'lo':{'$min':'$v'},
+                       'hi':{'$max':'$v'},'mean':{'$avg':'$v'}}},
+            {'$sort':{'total':-1}},
+            {'$limit':1}])
+        self.assertEqual(res.data, [{'_id':'b','n':2,'total':7,'lo':2,'hi':5,'mean':3.5}])
+        res = db.aggregate([{'$group':{'_id':None,'n':{'$sum':1}}}, {'$project':{'_id':0}}])
+        self.assertEqual(res.data, [{'n':7}])
+        self.assertRaises(Exception, db.aggregate, [{'$bogus':1}])
+
+    def test_insert_many(self):
+        db = db_object().insert({'x':0}).create_index('x', ordered=True).create_index('t')
+        db.insert_many([{'x':5,'t':'now()'},{'x':2,'_id':50},{'x':'s','t':'now()'},{'x':1}])
+        self.assertEqual([r['_id'] for r in db.find().data], [1,2,50,3,4])
+        self.assertEqual(db._data[1]['t'], db._data[3]['t'])
+        self.assertNotEqual(db._data[1]['t'], 'now()')
+        self.assertEqual([r['x'] for r in db.find({'x':{'$gte':1}}).sort({'x':1}).data], [1,2,5])
+        self.assertEqual(db.find({'t':db._data[1]['t']}).count(), 2)
+        db.insert_many([{'t':'now()'}], validate=False, stamp=False)
+        self.assertEqual(db.find({'t':'now()'}).count(), 1)
+        self.assertRaises(Exception, db.insert_many, [{'x':1}, 'row'])
+        self.assertEqual(db.count(), 6)
+        # small batches into a long run go in a key at a time
+        db = db_object().insert([{'x':i * 2} for i in range(300)]).create_index('x', ordered=True)
+        db.insert({'x':7})
+        db.insert_many([{'x':9},{'x':-1},{'x':'s'}])
+        self.assertEqual([r['x'] for r in db.find({'x':{'$lt':10}}).sort({'x':1}).data], [-1,0,2,4,6,7,8,9])
+        self.assertEqual(db._indexes['x'].nums[0], sorted(db._indexes['x'].nums[0]))
+
+    def test_regex_index(self):
+        rows = [{'k':'ORD-2026-1'},{'k':'ORD-2025'},{'k':'ord-2026-2'},{'k':12},{'k':True},{'k':'ORD-2026-3'}]
+        db = db_object().insert(copy.deepcopy(rows)).create_index('k', ordered=True)
+        plain = db_object().insert(copy.deepcopy(rows))
+        for q in [{'k':re.compile('^ORD-2026')}, {'k':{'$regex':'ORD-2026'}}, {'k':re.compile('1')},
+                  {'k':{'$regex':'^ord-2026','$options':'i'}}, {'k':re.compile('Tr')}]:
+            self.assertEqual(db.find(q).data, plain.find(q).data)
+        self.assertEqual([r['_id'] for r in db.find({'k':{'$regex':'^ord','$options':'i'}}).data], [1,2,3,6])
+        plan = db.explain({'k':re.compile('^ORD-2026')})
+        self.assertEqual([(st['stage'], st['rows_out']) for st in plan['stages']], [('index', 3), ('filter', 2)])
+        self.assertRaises(Exception, db.find, {'k':{'$regex':'a','$options':'q'}})
+        self.assertEqual(db.find({'k':{'$options':'i','$regex':'^ord-2026'}}).count(), 3)
+        self.assertEqual(db.find({'k':{'$regex':re.compile('^ord-2026'),'$options':'i'}}).count(), 3)
+        self.assertEqual(db.find({'k':{'$regex':re.compile('^ord', re.I)}}).count(), 4)
+
+    def test_find_many(self):
+        db = db_object().insert([{'u':i % 3,'n':i} for i in range(30)]).create_index('u')
+        queries = [{'n':{'$lt':5}}, {'u':1}, None, {'n':{'$gt':10}}, {'n':-1}]
+        limits = [None, 2, 4, 3, None]
+        res = db.find_many(queries, limits)
+        for q, limit, r in zip(queries, limits, res):
+            expect = db.find(q)
+            if limit is not None:
+                expect = expect.limit(limit)
+            self.assertEqual(r.data, expect.data)
+        self.assertEqual([r.count() for r in db.find_many(queries)], [5, 10, 30, 19, 0])
+        r = db.find_many([{'n':3}], projection={'n':1,'_id':0})[0]
+        self.assertEqual(r.data, [{'n':3}])
+        r.data[0]['n'] = 99
+        self.assertEqual(db.find({'n':99}).count(), 0)
+        self.assertRaises(Exception, db.find_many, [{'n':1}], [1, 2])
+
+    def test_view(self):
+        db = db_object().insert([{'s':'open','n':3},{'s':'done','n':1},{'s':'open','n':2}])
+        events = []
+        view = db.view({'s':'open'}, sort={'n':-1},
+                       callback=lambda event, row: events.append((event, row and row['_id'])))
+        self.assertEqual([r['_id'] for r in view.data], [1,3])
+        db.insert({'s':'open','n':5})
+        db.update({'_id':2}, {'$set':{'s':'open'}})
+        db.update({'_id':1}, {'$set':{'n':0}})
+        snap = db.snapshot()
+        db.update({'_id':3}, {'$set':{'s':'done'}})
+        db.remove({'_id':4})
+        self.assertEqual(events, [('added',4),('added',2),('changed',1),('removed',3),('removed',4)])
+        self.assertEqual([(r['_id'], r['n']) for r in view.data], [(2,1),(1,0)])
+        self.assertEqual(view.data, db.find({'s':'open'}).sort({'n':-1}).data)
+        view.data[0]['n'] = 99
+        self.assertEqual(db.find({'n':99}).count(), 0)
+        db.clear()
+        self.assertEqual((len(view), events[-1]), (0, ('reset', None)))
+        view.close()
+        db.insert({'s':'open','n':1})
+        self.assertEqual(view.count(), 0)
+
+    def test_view_missing_key(self):
+        filename = 'test_generated_eraseme.json'
+        db = db_object(path=filename, result_cache=8).insert({'s':'open','n':1})
+        view = db.view({'s':'open'}, sort={'n':1})
+        self.assertEqual(db.find({'s':'open'}).count(), 1)
+        db.insert({'s':'open'})
+        db.insert({'s':'open','n':'x'})
+        db.update({'_id':1}, {'$set':{'m':2}})
+        self.assertEqual(db.find({'s':'open'}).count(), 3)
+        self.assertEqual([r['_id'] for r in view.data], [1])
+        db.update({'_id':2}, {'$set':{'n':0}})
+        self.assertEqual([r['_id'] for r in view.data], [2,1])
+        db.save()
+        self.assertEqual(db_object(path=filename).load().count(), 3)
+        os.remove(filename)
+
+    def test_view_nan(self):
+        nan = float('nan')
+        db = db_object().insert([{'v':2},{'v':nan},{'v':1}])
+        view = db.view(sort={'v':1})
+        self.assertEqual([r['_id'] for r in view.rows()], [3,1])
+        db.remove({'_id':3})
+        self.assertEqual([r['_id'] for r in view.rows()], [1])
+        db.insert([{'v':nan},{'v':0}])
+        db.update({'_id':2}, {'$set':{'v':5}})
+        db.update({'_id':1}, {'$set':{'v':nan}})
+        self.assertEqual([r['_id'] for r in view.rows()], [5,2])
+        db.remove({'_id':5})
+        db.remove({'_id':2})
+        self.assertEqual(view.rows(), [])
+
+    def test_codec(self):
+        rows = [{'a':1,'s':'caf\u00e9','l':[1.5,None,{'x':True}]},{'a':2}]
+        for name in ('test_generated_eraseme.snap', 'test_generated_eraseme.json'):
+            db_object(path=name).data(copy.deepcopy(rows)).save()
+            self.assertEqual(db_object(path=name).load()._data, db_object().data(copy.deepcopy(rows))._data)
+        with open('test_generated_eraseme.snap', 'rb') as f:
+            self.assertTrue(f.read().startswith(db_codec.SNAP_MAGIC))
+        # the header wins over the extension
+        os.replace('test_generated_eraseme.snap', 'test_generated_eraseme.json')
+        self.assertEqual(db_object(path='test_generated_eraseme.json').load().count(), 2)
+        with open('test_generated_eraseme.json', 'w') as f:
+            f.write('[{"a":NaN,"_id":1}]')
+        db = db_object(path='test_generated_eraseme.json').load()
+        self.assertNotEqual(db._data[0]['a'], db._data[0]['a'])
+        db.insert({'b':[float('inf'), None]}).save()
+        with open('test_generated_eraseme.json', 'r') as f:
+            self.assertEqual(f.read(), '[{"a":NaN,"_id":1},{"b":[Infinity,null],"_id":2}]')
+        plain = db_codec(fast=False)
+        self.assertEqual(plain.dumps([{'a':1}], {'indent':2}), json.dumps([{'a':1}], indent=2).encode())
+        self.assertEqual(plain.loads(db_codec().dumps(rows)), rows)
+        self.assertRaises(Exception, plain.snap_loads, b'[]')
+        os.remove('test_generated_eraseme.json')
+        # a snapshot from a newer format is refused, and left as it was
+        data = db_codec.SNAP_MAGIC + bytes([db_codec.SNAP_VERSION + 1, 0]) + b'rows'
+        with open('test_generated_eraseme.snap', 'wb') as f:
+            f.write(data)
+        self.assertRaises(Exception, db_object(path='test_generated_eraseme.snap').load)
+        with open('test_generated_eraseme.snap', 'rb') as f:
+            self.assertEqual(f.read(), data)
+        os.remove('test_generated_eraseme.snap')
+
+    def test_database(self):
+        root = 'test_generated_eraseme_dir'
+        dbs = database(root)
+        dbs['users'].insert([{'name':'a'},{'name':'b'}])
+        dbs['events'].insert({'kind':'x'})
+        dbs.save()
+        db_object(path=os.path.join(root, 'logs.jsonl')).data([{'line':1}]).save()
+        dbs = database(root, memory_budget=60)
+        self.assertEqual(dbs.names(), ['events', 'logs', 'users'])
+        self.assertEqual(dbs.loaded(), [])
+        self.assertEqual(dbs['logs'].count(), 1)
+        self.assertEqual(dbs.loaded(), ['logs'])
+        users = dbs['users']
+        users.insert({'name':'c'})
+        dbs['events']
+        self.assertEqual(dbs.loaded(), ['events'])   # past the budget: the others let go
+        self.assertIs(dbs['users'], users)          # still held here, so picked back up
+        self.assertEqual(database(root)['users'].count(), 3)
+        saved = []
+        events = dbs['events']
+        events.save = lambda *a: saved.append(1)
+        dbs.save()
+        self.assertEqual(saved, [])
+        dbs.drop('logs')
+        self.assertNotIn('logs', dbs)
+        self.assertRaises(Exception, dbs.collection, '../etc')
+        shutil.rmtree(root)
+
+    def test_write_to(self):
+        rows = [{'a':i,'s':'x\ny','l':[i,{'b':None}]} for i in range(5)]
+        db = db_object(auto_index='').data(copy.deepcopy(rows))
+        self.assertEqual(db.toString(), json.dumps(rows, separators=(',',':')))
+        self.assertEqual(''.join(db.iter_json(chunk_rows=2, compact=False)), json.dumps(rows, indent=2))
+        self.assertEqual(len(list(db.iter_json(chunk_rows=2))), 3)
+        res = db.find({'a':{'$gte':3}})
+        self.assertEqual(''.join(res.iter_json(chunk_rows=1)), json.dumps(rows[3:], indent=2))
+        with open('test_generated_eraseme', 'wb') as f:
+            res.write_to(f, compact=True)
+        with open('test_generated_eraseme', 'r') as f:
+            self.assertEqual(json.load(f), rows[3:])
+        with open('test_generated_eraseme', 'w') as f:
+            db_object().write_to(f)
+        with open('test_generated_eraseme', 'r') as f:
+            self.assertEqual(f.read(), '[]')
+        os.remove('test_generated_eraseme')
+
+    def test_find_one(self):
+        db = db_object().insert([{'u':i % 3,'n':i,'d':{'x':i}} for i in range(30)])
+        for indexed in (False, True):
+            self.assertEqual(db.count(), 30)
+            self.assertEqual(db.count({'u':1,'n':{'$gt':10}}), db.find({'u':1,'n':{'$gt':10}}).count())
+            self.assertTrue(db.exists({'n':{'$gte':29}}))
+            self.assertFalse(db.exists({'u':5}))
+            self.assertEqual(db.find_one({'u':2,'n':{'$gt':6}})['n'], 8)
+            self.assertIsNone(db.find_one({'u':7}))
+            db.create_index('u')
+        self.assertEqual(db.find_one(projection={'n':1,'_id':0}), {'n':0})
+        row = db.find_one({'n':4})
+        row['d']['x'] = 99
+        self.assertEqual(db.count({'d':{'x':4}}), 1)
+        self.assertIs(db.find_one({'n':4}, copy=False), db._data[4])
+        self.assertFalse(db_object().exists())
+
 if __name__ == '__main__':
     unittest.main()